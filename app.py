@@ -7,6 +7,11 @@ import jpholiday
 import numpy as np
 from ortools.sat.python import cp_model
 import optimizer
+from constants import SUPPORT_STAFF_NAME
+import rules
+import store
+import compare
+import evaluate
 import copy
 import io
 from openpyxl.styles import PatternFill
@@ -29,11 +34,17 @@ if "staff_names" not in st.session_state:
 if "shifts" not in st.session_state:
     st.session_state.shifts = [{"label": "日勤", "hours": 8}]
 
+# 応援の内訳表示（"応援(日勤×2)" など）は集計・色付けでは「応援」として扱う
+def to_shift_key(shift):
+    if isinstance(shift, str) and shift.startswith("応援"):
+        return "応援"
+    return shift
+
 def to_colored_excel(df, year=None):
 
     used_shifts = set()
     for col in df.columns[:-1]:  # 最後の列は「総勤務時間」など集計なので除外
-        used_shifts.update(df[col].dropna().unique())
+        used_shifts.update(to_shift_key(v) for v in df[col].dropna().unique())
 
     color_map = {
         "休み": "FFFF00",
@@ -59,7 +70,7 @@ def to_colored_excel(df, year=None):
         for day in df.columns:
             if day == "総勤務時間":
                 continue
-            shift = df.at[staff, day]
+            shift = to_shift_key(df.at[staff, day])
             if shift in shift_labels:
                 shift_counts_df.at[staff, shift] += 1
 
@@ -75,7 +86,7 @@ def to_colored_excel(df, year=None):
         for row in range(2, len(df) + 2):
             for col in range(2, len(df.columns) + 2):
                 cell = ws.cell(row=row, column=col)
-                shift = cell.value
+                shift = to_shift_key(cell.value)
                 if shift in color_map:
                     fill = PatternFill(start_color=color_map[shift], end_color=color_map[shift], fill_type="solid")
                     cell.fill = fill
@@ -96,11 +107,52 @@ def to_colored_excel(df, year=None):
 
     return output.getvalue()
 
+# シフト結果の表（総勤務時間つき）とシフト別集計表を作る
+def build_result_tables(result, dates, shifts, daily_work_hours):
+    df_result = pd.DataFrame(result).T
+    df_result = df_result[[d for d in dates if d in df_result.columns]]
+    df_result.columns = [
+        d.strftime("%m/%d") if hasattr(d, "strftime") else str(d)
+        for d in df_result.columns
+    ]
+
+    shift_hours_map = {s["label"]: s["hours"] for s in shifts}
+    total_hours = []
+    for staff in df_result.index:
+        total = 0
+        daily_hour = daily_work_hours.get(staff, 0)
+        for day in df_result.columns:
+            shift = df_result.at[staff, day]
+            if shift == "有給":
+                total += daily_hour
+            else:
+                total += shift_hours_map.get(shift, 0)
+        total_hours.append(total)
+
+    df_result["総勤務時間"] = total_hours
+
+    # シフト別集計（総勤務時間列を除外）
+    shift_labels = [s["label"] for s in shifts] + ["休み", "有給", "応援"]
+    shift_counts_df = pd.DataFrame(index=df_result.index, columns=shift_labels).fillna(0)
+
+    for staff in df_result.index:
+        for day in df_result.columns:
+            if day == "総勤務時間":
+                continue
+            shift = to_shift_key(df_result.at[staff, day])
+            if shift in shift_counts_df.columns:
+                shift_counts_df.at[staff, shift] += 1
+
+    shift_counts_df["総勤務時間"] = df_result["総勤務時間"]
+    shift_counts_df = shift_counts_df.astype(int)
+    return df_result, shift_counts_df
+
 # 🗓️ 年月設定
 with tab1:
     st.subheader("対象年月を選択してください")
     year = st.selectbox("年", range(2024, 2031), index=1)
     month = st.selectbox("月", range(1, 13), index=date.today().month - 1)
+    st.session_state["site"] = st.text_input("拠点名（保存済みシフトの検索に使用）", value=st.session_state.get("site", ""))
     num_days = monthrange(year, month)[1]
     dates = [date(year, month, d+1) for d in range(num_days)]
     st.session_state["dates"] = dates
@@ -116,7 +168,7 @@ with tab2:
         1 for d in dates if d.weekday() < 5 and not jpholiday.is_holiday(d))
     st.info(f"この月の平日数は **{num_weekdays}日** です。")
 
-    num_staff = st.number_input("スタッフ数", 1, 20, 5)
+    num_staff = st.number_input("スタッフ数", 1, 500, 5)
 
     staff_names = []
     daily_work_hours_dict = {}
@@ -237,7 +289,7 @@ with tab4:
         batch_input[shift] = cols[i].number_input(
             f"{shift}",
             min_value=0,
-            max_value=20,
+            max_value=500,
             value=0,
             key=f"batch_{shift}"
         )
@@ -301,7 +353,7 @@ with tab4:
                         new_val = st.number_input(
                             f"{shift}",
                             min_value=0,
-                            max_value=20,
+                            max_value=500,
                             value=current_val,
                             key=key
                         )
@@ -398,6 +450,13 @@ with tab6:
 
     # 1. 各種制約の重みをスライダーで調整
     st.subheader("⚙️ ソフト制約の重み設定")
+    objective_mode_label = st.radio(
+        "最適化の方法",
+        ["重み付き（スライダーの重みで合算）", "優先順位（応援→対応不可→労働時間→均等化→日勤誘導の順に段階的に最適化）"],
+    )
+    objective_mode = "staged" if objective_mode_label.startswith("優先順位") else "weighted"
+    if objective_mode == "staged":
+        st.caption("優先順位モードではスライダーは 0 でその項目を無効化する用途のみに使われます。")
     support_penalty = st.slider("🆘 応援使用許容度（高いほど最低限の応援", 0, 5000, 1000, step=100)
     shift_compat_penalty = st.slider("❌ 対応不可シフト許容度（高いほど可能なシフト以外割り当てられない", 0, 1000, 50, step=10)
     workload_diff_penalty = st.slider("📉 月の労働時間に近づける（基本はMAX", 0, 5000, 50, step=100)
@@ -410,9 +469,32 @@ with tab6:
         "day_shift_bonus": day_shift_bonus,
     }
 
+    # 2. 勤務ルール
+    st.subheader("📏 勤務ルール")
+    rule_shift_labels = [s["label"] for s in st.session_state["shifts"]]
+    rule_cols = st.columns(3)
+    max_consecutive_work = rule_cols[0].number_input("連続勤務の上限（日）", 1, 31, 6)
+    min_consecutive_work = rule_cols[1].number_input("連続勤務の下限（日）", 1, 7, 1)
+    max_work_days_per_week = rule_cols[2].number_input("7日間の勤務日数上限", 1, 7, 7)
+    rest_after_shifts = st.multiselect("翌日を休みにするシフト（夜勤明けなど）", rule_shift_labels)
+    sequence_options = [f"{a}→{b}" for a in rule_shift_labels for b in rule_shift_labels]
+    forbidden_pairs = st.multiselect("禁止するシフトの並び（前日→当日）", sequence_options)
+
+    st.session_state["work_rules"] = {
+        "max_consecutive_work": max_consecutive_work,
+        "min_consecutive_work": min_consecutive_work,
+        "max_work_days_per_week": max_work_days_per_week if max_work_days_per_week < 7 else None,
+        "min_rest_after": {label: 1 for label in rest_after_shifts},
+        "forbidden_sequences": [pair.split("→") for pair in forbidden_pairs],
+    }
+    rule_errors = rules.work_rule_errors(st.session_state["work_rules"])
+    for message in rule_errors:
+        st.error(f"⚠️ {message}")
+
     
     col1, col2, col3 = st.columns([1, 1, 1])
     trigger = False
+    st.session_state.setdefault("solution_index", 0)
 
     if col1.button("⬅️ 前のシフト案を見る"):
         if st.session_state.solution_index > 0:
@@ -429,83 +511,183 @@ with tab6:
         st.session_state.solution_index += 1
         trigger = True
 
-    if trigger:
-        with st.spinner("シフトを最適化中..."):
-            result = optimizer.optimize_shifts(
-                staff_names=st.session_state["staff_names"],
-                shifts=st.session_state["shifts"],
-                dates=st.session_state["dates"],
-                required_staff=st.session_state["required_staff"],
-                leave_requests=st.session_state["leave_requests"],
-                daily_work_hours=st.session_state["daily_work_hours"],
-                use_support_shift=st.session_state["use_support_shift"],
-                total_work_hours=st.session_state["total_work_hours"],
-                shift_compatibility=st.session_state.get("shift_compatibility"),
-                strict_staffing_days=st.session_state.get("strict_staffing_days"),
-                solution_index=st.session_state.solution_index,
-                max_solutions=10,
-                penalties=st.session_state["penalties"]
-            )
+    # 勤務ルールが矛盾していると必ず解なしになるので、解かずに止める
+    if trigger and rule_errors:
+        st.error("勤務ルールを見直してから実行してください。")
+        trigger = False
+
+    # 最適化の入力（保存時の入力ハッシュにも使う）
+    solve_inputs = {
+        "staff_names": st.session_state["staff_names"],
+        "shifts": st.session_state["shifts"],
+        "dates": st.session_state["dates"],
+        "required_staff": st.session_state.get("required_staff", {}),
+        "leave_requests": st.session_state.get("leave_requests", {}),
+        "daily_work_hours": st.session_state["daily_work_hours"],
+        "use_support_shift": st.session_state["use_support_shift"],
+        "total_work_hours": st.session_state["total_work_hours"],
+        "shift_compatibility": st.session_state.get("shift_compatibility"),
+        "strict_staffing_days": st.session_state.get("strict_staffing_days"),
+        "penalties": st.session_state["penalties"],
+        "work_rules": st.session_state["work_rules"],
+        "objective_mode": objective_mode,
+    }
+    site = st.session_state.get("site", "")
+    use_warm_start = st.checkbox("💾 同じ拠点・年月の保存済みシフトを初期解に使う", value=True)
 
-        if result is None:
+    if trigger:
+        input_hash = store.instance_hash(solve_inputs, site)
+        # 同じ入力・同じ解番号が保存済みなら解き直さずに読み込む
+        cached = store.find_solutions(input_hash=input_hash, solution_index=st.session_state.solution_index, limit=1)
+        if cached:
+            st.session_state["latest_solution_id"] = cached[0]["id"]
+        elif store.find_solutions(input_hash=input_hash, limit=1):
+            # 解の候補はまとめて保存済み。範囲外なら解き直さない
             st.warning("これ以上のシフト案は見つかりません。最初の解に戻してください。")
             st.session_state.solution_index = 0
         else:
-            st.session_state["latest_result"] = result
-
-            df_result = pd.DataFrame(result).T
-            df_result.columns = [
-                d.strftime("%m/%d") if hasattr(d, "strftime") else str(d)
-                for d in df_result.columns
-            ]
-
-            shift_hours_map = {s["label"]: s["hours"] for s in st.session_state["shifts"]}
-            total_hours = []
-            for staff in df_result.index:
-                total = 0
-                daily_hour = st.session_state["daily_work_hours"].get(staff, 0)
-                for day in df_result.columns:
-                    shift = df_result.at[staff, day]
-                    if shift == "有給":
-                        total += daily_hour
-                    else:
-                        total += shift_hours_map.get(shift, 0)
-                total_hours.append(total)
-
-            df_result["総勤務時間"] = total_hours
-            st.session_state["latest_df_result"] = df_result
-
-        if "latest_df_result" in st.session_state:
-            df_result = st.session_state["latest_df_result"].copy()
-            shift_labels = [s["label"] for s in st.session_state["shifts"]] + ["休み", "有給", "応援"]
-        
-            # シフト別集計（総勤務時間列を除外）
-            shift_counts_df = pd.DataFrame(index=df_result.index, columns=shift_labels).fillna(0)
-        
-            for staff in df_result.index:
-                for day in df_result.columns:
-                    if day == "総勤務時間":
-                        continue
-                    shift = df_result.at[staff, day]
-                    if shift in shift_counts_df.columns:
-                        shift_counts_df.at[staff, shift] += 1
-        
-            shift_counts_df["総勤務時間"] = df_result["総勤務時間"]
-            
-            shift_counts_df = shift_counts_df.astype(int)
-            st.session_state["shift_counts_df"] = shift_counts_df  # ← 追加
-        
-    # ✅ 表示（セッションに保存された結果を使う）
-    if "latest_df_result" in st.session_state:
-        st.success(f"✅ 解 #{st.session_state.solution_index + 1} を表示中")
-        st.dataframe(st.session_state["latest_df_result"], use_container_width=True)
-
-        if "shift_counts_df" in st.session_state:
-            st.markdown("### 📊 シフト割当数（スタッフ別）")
-            st.dataframe(st.session_state["shift_counts_df"], use_container_width=True)
+            warm_start = None
+            if use_warm_start:
+                # 解の候補は良い順に保存しているので、直近の解きなおしの先頭（solution_index=0）を使う
+                previous = store.find_solutions(site=site, year=year, month=month, solution_index=0, limit=1)
+                if previous:
+                    warm_start = store.load_solution(previous[0]["id"])["roster"]
+
+            stage_report = []
+            solution_pool = []
+            solve_stats = {}
+            with st.spinner("シフトを最適化中..."):
+                result = optimizer.optimize_shifts(
+                    **solve_inputs,
+                    solution_index=st.session_state.solution_index,
+                    max_solutions=10,
+                    stage_report=stage_report,
+                    warm_start=warm_start,
+                    solution_pool=solution_pool,
+                    solve_stats=solve_stats
+                )
+
+            if result is None:
+                st.warning("これ以上のシフト案は見つかりません。最初の解に戻してください。")
+                st.session_state.solution_index = 0
+            else:
+                # 見つかった案はすべて保存し、前後の切替は保存済みの案を読むだけにする
+                instance_id = store.save_instance(solve_inputs, site=site, year=year, month=month)
+                for index, solution in enumerate(solution_pool):
+                    solution_id = store.save_solution(
+                        instance_id,
+                        solution,
+                        st.session_state["staff_names"],
+                        st.session_state["dates"],
+                        solution_index=index,
+                        stats={
+                            "objective_mode": objective_mode,
+                            "stages": stage_report,
+                            "status": solve_stats["status"],
+                            "objective": solve_stats["pool_objectives"][index],
+                            "solve_time": solve_stats["solve_time"],
+                            "hint_time": solve_stats["hint_time"],
+                        },
+                    )
+                    if index == st.session_state.solution_index:
+                        st.session_state["latest_solution_id"] = solution_id
+
+    # 📚 保存済みのシフト案（同じ拠点・年月）
+    saved_rows = store.find_solutions(site=site, year=year, month=month)
+    if saved_rows:
+        with st.expander(f"📚 保存済みのシフト案（{len(saved_rows)}件）"):
+            st.dataframe(
+                pd.DataFrame(saved_rows)[["id", "created_at", "solution_index", "status", "objective", "solve_time"]],
+                use_container_width=True,
+            )
+            selected_id = st.selectbox("表示するシフト案のID", [row["id"] for row in saved_rows])
+            if st.button("📂 このシフト案を表示"):
+                st.session_state["latest_solution_id"] = selected_id
+
+    # ✅ 表示（保存済みの解を都度読み込む。セッションには ID だけを持つ）
+    saved = None
+    if "latest_solution_id" in st.session_state:
+        saved = store.load_solution(st.session_state["latest_solution_id"])
+
+    if saved is not None:
+        df_result, shift_counts_df = build_result_tables(
+            saved["roster"], saved["dates"], st.session_state["shifts"], st.session_state["daily_work_hours"]
+        )
+        st.success(f"✅ 解 #{saved['solution_index'] + 1} を表示中（保存ID: {saved['id']}）")
+        st.dataframe(df_result, use_container_width=True)
+
+        stages = saved["stats"].get("stages") or []
+        if stages:
+            st.markdown("### ⏱️ 段階ごとの最適化結果")
+            st.dataframe(pd.DataFrame(stages), use_container_width=True)
+
+        st.markdown("### 📊 シフト割当数（スタッフ別）")
+        st.dataframe(shift_counts_df, use_container_width=True)
         
+        # ✏️ 手修正したシフト表をその場で採点（ソルバーは使わない）
+        with st.expander("✏️ シフト表を手修正して検証"):
+            edit_staff = [name for name in saved["staff_names"] if name != SUPPORT_STAFF_NAME]
+            edit_df = pd.DataFrame(
+                [[saved["roster"].get(name, {}).get(d, "") for d in saved["dates"]] for name in edit_staff],
+                index=edit_staff,
+                columns=[d.strftime("%m/%d") for d in saved["dates"]],
+            )
+            edited_df = st.data_editor(edit_df, use_container_width=True, key=f"roster_editor_{saved['id']}")
+            edited_roster = {
+                name: {d: label for d, label in zip(saved["dates"], edited_df.loc[name].tolist()) if label}
+                for name in edit_staff
+            }
+            if SUPPORT_STAFF_NAME in saved["roster"]:
+                edited_roster[SUPPORT_STAFF_NAME] = saved["roster"][SUPPORT_STAFF_NAME]
+
+            evaluation = evaluate.evaluate_roster(solve_inputs, edited_roster)
+            st.markdown("#### 目的関数の内訳")
+            st.dataframe(pd.DataFrame([evaluation["objective"]], index=["修正後"]), use_container_width=True)
+            if evaluation["feasible"]:
+                st.success("✅ 必須制約をすべて満たしています")
+            else:
+                st.error(f"⚠️ 必須制約の違反が {len(evaluation['violations'])} 件あります")
+                st.dataframe(evaluation["violations"], use_container_width=True)
+
+        # 🔍 シフト案の比較（同じ入力で保存された案どうし）
+        pool_rows = sorted(
+            store.find_solutions(input_hash=store.instance_hash(solve_inputs, site)),
+            key=lambda row: row["solution_index"],
+        )
+        if len(pool_rows) >= 2:
+            with st.expander(f"🔍 シフト案の比較（{len(pool_rows)}案）"):
+                # 全案の読込は比較するときだけ（閉じていても中身は毎回実行されるため）
+                if st.checkbox("保存済みの案を読み込んで比較する", key="compare_plans"):
+                    pool = [store.load_solution(row["id"]) for row in pool_rows]
+                    codes, labels, pool_staff, pool_dates = compare.stack_solutions(pool)
+
+                    breakdown = evaluate.objective_breakdown(
+                        codes, labels, pool_staff, st.session_state["shifts"],
+                        st.session_state["daily_work_hours"],
+                        total_work_hours=st.session_state["total_work_hours"],
+                        shift_compatibility=st.session_state.get("shift_compatibility"),
+                        penalties=st.session_state["penalties"],
+                    )
+                    breakdown.index = [f"案{row['solution_index'] + 1}" for row in pool_rows]
+                    st.markdown("#### 目的関数の内訳")
+                    st.dataframe(breakdown, use_container_width=True)
+
+                    plan_names = list(breakdown.index)
+                    cmp_cols = st.columns(2)
+                    plan_a = cmp_cols[0].selectbox("比較元", plan_names, index=0)
+                    plan_b = cmp_cols[1].selectbox("比較先", plan_names, index=1)
+                    diff = compare.compare_plans(
+                        codes, labels, pool_staff, pool_dates, st.session_state["shifts"],
+                        st.session_state["daily_work_hours"],
+                        plan_names.index(plan_a), plan_names.index(plan_b),
+                    )
+                    st.markdown(f"#### 変更されたセル（{len(diff['cells'])}件）")
+                    st.dataframe(diff["cells"], use_container_width=True)
+                    st.markdown("#### スタッフ別の勤務時間・シフト回数の差")
+                    st.dataframe(diff["staff"], use_container_width=True)
+
         # Excelダウンロード用
-        excel_data = to_colored_excel(st.session_state["latest_df_result"])
+        excel_data = to_colored_excel(df_result)
 
         # 年月のフォールバック（未定義時用）
         year = st.session_state.get("selected_year", 2025)
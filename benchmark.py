@@ -0,0 +1,105 @@
+import argparse
+import random
+from datetime import date, timedelta
+
+import multi_site
+
+
+# ベンチマーク用の合成インスタンス（拠点ごとに日勤・遅番・夜勤）
+def make_instance(num_staff=500, num_sites=5, num_days=30, seed=0):
+    rng = random.Random(seed)
+    start = date(2025, 4, 1)
+    dates = [start + timedelta(days=i) for i in range(num_days)]
+    sites = [f"病棟{j + 1}" for j in range(num_sites)]
+    shifts = [
+        {"label": "日勤", "hours": 8},
+        {"label": "遅番", "hours": 8},
+        {"label": "夜勤", "hours": 16},
+    ]
+
+    staff_names = [f"スタッフ{i + 1}" for i in range(num_staff)]
+    staff_home_sites = {name: sites[i % num_sites] for i, name in enumerate(staff_names)}
+
+    leave_requests = {}
+    for name in staff_names:
+        days_off = rng.sample(dates, 2)
+        paid = rng.sample([d for d in dates if d not in days_off], 1)
+        leave_requests[name] = {"希望休": days_off, "有給": paid, "シフト希望": {}}
+
+    daily_work_hours = {name: 8 for name in staff_names}
+    num_weekdays = sum(1 for d in dates if d.weekday() < 5)
+    total_work_hours = {name: 8 * num_weekdays for name in staff_names}
+
+    # 一覧にないシフト（休みを含む）は対応不可として罰則がかかるので、休みは全員に入れておく
+    shift_compatibility = {}
+    for name in staff_names:
+        if rng.random() < 0.2:
+            shift_compatibility[name] = ["日勤", "遅番", "休み"]
+        else:
+            shift_compatibility[name] = ["日勤", "遅番", "夜勤", "休み"]
+
+    # 拠点の規模に応じた必要人数（週末は日勤を減らす）
+    required_staff = {}
+    for j, site in enumerate(sites):
+        site_staff = sum(1 for name in staff_names if staff_home_sites[name] == site)
+        required_staff[site] = {}
+        for d in dates:
+            weekend = d.weekday() >= 5
+            day = max(1, site_staff * (25 if weekend else 40) // 100)
+            late = max(1, site_staff * 12 // 100)
+            night = max(1, site_staff * 10 // 100)
+            # 拠点ごとに需要の偏りをつけて貸し借りを発生させる
+            if (d.day + j) % 7 == 0:
+                day += max(1, site_staff // 10)
+            required_staff[site][d] = {"日勤": day, "遅番": late, "夜勤": night}
+
+    return {
+        "sites": sites,
+        "staff_names": staff_names,
+        "staff_home_sites": staff_home_sites,
+        "shifts": shifts,
+        "dates": dates,
+        "required_staff": required_staff,
+        "leave_requests": leave_requests,
+        "daily_work_hours": daily_work_hours,
+        "total_work_hours": total_work_hours,
+        "shift_compatibility": shift_compatibility,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数拠点シフト最適化のベンチマーク")
+    parser.add_argument("--staff", type=int, nargs="+", default=[50, 100, 250, 500])
+    parser.add_argument("--sites", type=int, default=5)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--support-capacity", type=int, default=5)
+    parser.add_argument("--time-limit", type=float, default=60.0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--objective-mode", choices=["weighted", "staged"], default="weighted")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'staff':>6} {'sites':>5} {'days':>4} {'vars':>8} {'cons':>8} "
+          f"{'build[s]':>9} {'hint[s]':>8} {'solve[s]':>9} {'status':>9} {'objective':>12} {'bound':>12}")
+    for num_staff in args.staff:
+        instance = make_instance(num_staff, args.sites, args.days, args.seed)
+        result = multi_site.optimize_multi_site(
+            **instance,
+            support_capacity=args.support_capacity,
+            max_time_in_seconds=args.time_limit,
+            num_workers=args.workers,
+            objective_mode=args.objective_mode,
+        )
+        stats = result["stats"]
+        objective = "-" if stats["objective"] is None else f"{stats['objective']:.0f}"
+        bound = "-" if stats["best_bound"] is None else f"{stats['best_bound']:.0f}"
+        print(f"{num_staff:>6} {args.sites:>5} {args.days:>4} {stats['num_variables']:>8} "
+              f"{stats['num_constraints']:>8} {stats['build_time']:>9.2f} {stats['hint_time']:>8.2f} {stats['solve_time']:>9.2f} "
+              f"{stats['status']:>9} {objective:>12} {bound:>12}")
+        for entry in stats.get("stages", []):
+            value = "-" if entry["value"] is None else entry["value"]
+            print(f"{'':>6} stage {entry['stage']:<14} {entry['time']:>7.2f}s {entry['status']:>9} {value:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from evaluate import label_counts, staff_hours
+
+
+def stack_solutions(solutions):
+    # store.load_solution の結果のリストを、共通のラベル番号を持つ (案 × スタッフ × 日) 配列にまとめる
+    staff_names = list(solutions[0]["staff_names"])
+    staff_to_row = {name: i for i, name in enumerate(staff_names)}
+    for solution in solutions[1:]:
+        for name in solution["staff_names"]:
+            if name not in staff_to_row:
+                staff_to_row[name] = len(staff_names)
+                staff_names.append(name)
+    dates = solutions[0]["dates"]
+
+    labels = [None] + sorted({label for solution in solutions for label in solution["labels"][1:]})
+    label_to_code = {label: i for i, label in enumerate(labels)}
+    codes = np.zeros((len(solutions), len(staff_names), len(dates)), dtype=np.uint8)
+    for p, solution in enumerate(solutions):
+        # 案ごとのラベル番号を共通の番号へ置き換える（ルックアップ配列で一括変換）
+        remap = np.array([label_to_code[label] for label in solution["labels"]], dtype=np.uint8)
+        if solution["staff_names"] == staff_names:
+            # 同じ入力の案どうしなら行の並びは同じ
+            codes[p] = remap[solution["codes"]]
+        else:
+            rows = [staff_to_row[name] for name in solution["staff_names"]]
+            codes[p, rows] = remap[solution["codes"]]
+    return codes, labels, staff_names, dates
+
+
+def compare_plans(codes, labels, staff_names, dates, shifts, daily_work_hours, a, b):
+    # 案 a → 案 b の差分（変更セル・スタッフ別の勤務時間とシフト回数の増減）
+    changed = codes[a] != codes[b]
+    rows, cols = np.nonzero(changed)
+    label_array = np.array(labels, dtype=object)
+    cell_diff = pd.DataFrame({
+        "スタッフ": np.array(staff_names, dtype=object)[rows],
+        "日付": np.array(dates, dtype=object)[cols],
+        "変更前": label_array[codes[a][rows, cols]],
+        "変更後": label_array[codes[b][rows, cols]],
+    })
+
+    pair = codes[[a, b]]
+    hours = staff_hours(pair, labels, staff_names, shifts, daily_work_hours)
+    counts = label_counts(pair, len(labels))
+    count_delta = pd.DataFrame(counts[1, :, 1:] - counts[0, :, 1:], index=staff_names, columns=labels[1:])
+    count_delta = count_delta.loc[:, (count_delta != 0).any(axis=0)]
+
+    staff_delta = pd.DataFrame({
+        "変更セル数": changed.sum(axis=1),
+        "勤務時間(前)": hours[0],
+        "勤務時間(後)": hours[1],
+        "勤務時間差": hours[1] - hours[0],
+    }, index=staff_names)
+    return {
+        "cells": cell_diff,
+        "staff": staff_delta.join(count_delta),
+    }
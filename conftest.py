@@ -0,0 +1 @@
+# リポジトリ直下のモジュール（rules.py など）を tests/ から import できるようにするための置き場所
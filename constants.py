@@ -0,0 +1,4 @@
+# ソルバーに依存しないモジュール（evaluate など）からも使う共通の定数
+
+# 応援の人数をまとめて表示する臨時スタッフ行の名前
+SUPPORT_STAFF_NAME = "（応援）臨時スタッフ"
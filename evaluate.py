@@ -0,0 +1,281 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+import rules
+import store
+from constants import SUPPORT_STAFF_NAME
+
+# 目的関数の内訳の列（optimize_shifts の目的成分と同じ名前）＋重み付き合計
+BREAKDOWN_COLUMNS = ["support", "shift_compat", "workload_diff", "shift_balance", "day_shift", "total"]
+VIOLATION_COLUMNS = ["種類", "スタッフ", "日付", "シフト", "内容"]
+
+
+def evaluate_roster(instance, roster):
+    # ソルバーを使わずにシフト表を採点する。
+    #   instance : optimize_shifts に渡す引数の dict（staff_names, shifts, dates, required_staff, ...）
+    #   roster   : {スタッフ: {日付: ラベル}}（optimize_shifts の戻り値と同じ形）
+    # 戻り値は {"objective": 目的関数の内訳, "violations": 守れていない必須制約の DataFrame, "feasible": bool}
+    staff_names = list(instance["staff_names"])
+    dates = instance["dates"]
+    names = staff_names + ([SUPPORT_STAFF_NAME] if SUPPORT_STAFF_NAME in roster else [])
+    codes, labels = store.encode_roster(roster, names, dates)
+
+    breakdown = objective_breakdown(
+        codes[None], labels, names, instance["shifts"], instance.get("daily_work_hours", {}),
+        total_work_hours=instance.get("total_work_hours"),
+        shift_compatibility=instance.get("shift_compatibility"),
+        penalties=instance.get("penalties"),
+    )
+    violations = find_violations(instance, codes, labels, names)
+    return {
+        "objective": breakdown.iloc[0].to_dict(),
+        "violations": violations,
+        "feasible": violations.empty,
+    }
+
+
+def find_violations(instance, codes, labels, staff_names):
+    # optimize_shifts の必須制約（1日1シフト・希望休/有給/希望シフト・勤務ルール・必要人数・応援枠）を
+    # (スタッフ × 日) のラベル番号配列に対してまとめて判定する
+    dates = instance["dates"]
+    shift_labels = [s["label"] for s in instance["shifts"] if s["label"] not in ["休み", "応援"]]
+    leave_requests = instance.get("leave_requests") or {}
+    label_array = np.array(labels, dtype=object)
+    code_of = {label: i for i, label in enumerate(labels) if label is not None}
+    found = []
+
+    def add(kind, mask, rows, detail, day_offset=0):
+        for s, d in zip(*np.nonzero(mask)):
+            s_idx = rows[s]
+            d_idx = d + day_offset
+            found.append((kind, staff_names[s_idx], dates[d_idx], label_array[codes[s_idx, d_idx]], detail))
+
+    staff_rows = [s for s, name in enumerate(staff_names) if name != SUPPORT_STAFF_NAME]
+    staff = codes[staff_rows]
+
+    # 1日1シフト（未割当・定義されていないシフト）
+    known = np.zeros(len(labels), dtype=bool)
+    for label in shift_labels + ["休み", "有給"]:
+        if label in code_of:
+            known[code_of[label]] = True
+    add("未割当", staff == 0, staff_rows, "シフトが入っていません")
+    add("不明なシフト", (staff != 0) & ~known[staff], staff_rows, "定義されていないシフトです")
+
+    # 希望休・有給・希望シフト
+    date_index = {date: d for d, date in enumerate(dates)}
+    rest_codes = [code_of[label] for label in ["休み", "有給"] if label in code_of]
+    for row, s in enumerate(staff_rows):
+        requests = leave_requests.get(staff_names[s], {})
+        for kind, label in [("希望休", "休み"), ("有給", "有給")]:
+            days = [date_index[date] for date in requests.get(kind, []) if date in date_index]
+            bad = [d for d in days if staff[row, d] not in rest_codes]
+            for d in bad:
+                found.append((kind, staff_names[s], dates[d], label_array[staff[row, d]], f"{label}にする必要があります"))
+        for date, shift_pref in (requests.get("シフト希望") or {}).items():
+            d = date_index.get(date)
+            if d is not None and shift_pref in shift_labels + ["休み"] and label_array[staff[row, d]] != shift_pref:
+                found.append(("シフト希望", staff_names[s], date, label_array[staff[row, d]], f"{shift_pref}の希望です"))
+        paid_days = set(date_index[date] for date in requests.get("有給", []) if date in date_index)
+        if "有給" in code_of:
+            for d in np.nonzero(staff[row] == code_of["有給"])[0]:
+                if d not in paid_days:
+                    found.append(("有給", staff_names[s], dates[d], "有給", "有給の申請がない日です"))
+
+    # 勤務ルール（同じルールのスタッフをまとめて判定）
+    work = np.zeros(len(labels), dtype=bool)
+    for label in shift_labels:
+        if label in code_of:
+            work[code_of[label]] = True
+    groups = {}
+    for row, s in enumerate(staff_rows):
+        rule = rules.resolve_work_rules(instance.get("work_rules"), staff_names[s])
+        key = (rules.work_rule_key(rule), rule.get("max_work_days_per_week"))
+        groups.setdefault(key, (rule, []))[1].append(row)
+    for rule, group in groups.values():
+        rows = [staff_rows[row] for row in group]
+        found += _rule_violations(rule, staff[group], work[staff[group]], rows, code_of, label_array, staff_names, dates)
+
+    # 必要人数・応援
+    support_rows = [s for s, name in enumerate(staff_names) if name == SUPPORT_STAFF_NAME]
+    support = np.zeros((len(shift_labels), len(dates)), dtype=int)
+    if support_rows:
+        for i, label in enumerate(shift_labels):
+            heads = np.array([parse_support(l).get(label, 0) for l in labels])
+            support[i] = heads[codes[support_rows[0]]]
+    required_staff = instance.get("required_staff") or {}
+    strict = instance.get("strict_staffing_days") or {}
+    max_support = instance.get("max_support_per_shift")
+    use_support = instance.get("use_support_shift", False)
+    for i, label in enumerate(shift_labels):
+        assigned = (staff == code_of[label]).sum(axis=0) if label in code_of else np.zeros(len(dates), dtype=int)
+        required = np.array([required_staff.get(date, {}).get(label, 0) for date in dates])
+        is_strict = np.array([strict.get(date, False) for date in dates])
+        covered = assigned + support[i]
+        upper = required if max_support is None else np.minimum(required, max_support)
+        if not use_support:
+            upper = np.zeros_like(required)
+        for d in np.nonzero(support[i] > upper)[0]:
+            found.append(("応援上限", SUPPORT_STAFF_NAME, dates[d], label, f"応援{support[i][d]}人（上限{upper[d]}人）"))
+        for d in np.nonzero((required == 0) & (assigned > 0))[0]:
+            found.append(("必要人数0", "", dates[d], label, f"必要人数0のシフトに{assigned[d]}人"))
+        for d in np.nonzero((required > 0) & (covered < required))[0]:
+            found.append(("必要人数不足", "", dates[d], label, f"{covered[d]}人（必要{required[d]}人）"))
+        for d in np.nonzero((required > 0) & is_strict & (covered > required))[0]:
+            found.append(("必要人数超過", "", dates[d], label, f"{covered[d]}人（固定{required[d]}人）"))
+
+    return pd.DataFrame(found, columns=VIOLATION_COLUMNS)
+
+
+def _rule_violations(rule, codes, work, rows, code_of, label_array, staff_names, dates):
+    # codes/work: (スタッフ × 日)。prefix[:, d] は d 日目より前の勤務日数（モデルの累積和と同じ定義）
+    num_days = codes.shape[1]
+    prefix = np.concatenate([np.zeros((len(rows), 1), dtype=int), np.cumsum(work, axis=1)], axis=1)
+    found = []
+
+    def add(kind, mask, detail, day_offset=0):
+        for s, d in zip(*np.nonzero(mask)):
+            d_idx = d + day_offset
+            found.append((kind, staff_names[rows[s]], dates[d_idx], label_array[codes[s, d_idx]], detail))
+
+    max_work = rule.get("max_consecutive_work")
+    if max_work and num_days > max_work:
+        window = prefix[:, max_work + 1:] - prefix[:, :num_days - max_work]
+        add("連続勤務上限", window > max_work, f"{max_work + 1}日連続勤務", day_offset=max_work)
+
+    min_work = rule.get("min_consecutive_work") or 0
+    if min_work > 1 and num_days > min_work:
+        last = num_days - min_work + 1
+        run_start = work[:, 1:last] & ~work[:, :last - 1]
+        run_length = prefix[:, 1 + min_work:last + min_work] - prefix[:, 1:last]
+        add("連続勤務下限", run_start & (run_length < min_work), f"{min_work}日未満の連続勤務", day_offset=1)
+
+    weekly_cap = rule.get("max_work_days_per_week")
+    if weekly_cap is not None and weekly_cap < min(7, num_days):
+        span = min(7, num_days)
+        window = prefix[:, span:] - prefix[:, :num_days - span + 1]
+        add("週の勤務日数上限", window > weekly_cap, f"7日間で{weekly_cap}日を超える勤務", day_offset=span - 1)
+
+    for label, days in (rule.get("min_rest_after") or {}).items():
+        if label not in code_of or days <= 0:
+            continue
+        after = codes == code_of[label]
+        for offset in range(1, min(days, num_days - 1) + 1):
+            add("明けの休み", after[:, :-offset] & work[:, offset:], f"{label}の翌{offset}日目は休み", day_offset=offset)
+
+    for seq in rule.get("forbidden_sequences") or []:
+        if len(seq) < 2 or any(label not in code_of for label in seq) or num_days < len(seq):
+            continue
+        span = num_days - len(seq) + 1
+        match = np.ones((len(rows), span), dtype=bool)
+        for i, label in enumerate(seq):
+            match &= codes[:, i:i + span] == code_of[label]
+        add("禁止並び", match, "→".join(seq))
+
+    return found
+
+
+def parse_support(label):
+    # "応援(日勤×2・夜勤)" → {"日勤": 2, "夜勤": 1}
+    match = re.fullmatch(r"応援\((.*)\)", label or "")
+    if not match:
+        return {}
+    heads = {}
+    for part in match.group(1).split("・"):
+        name, _, count = part.partition("×")
+        heads[name] = heads.get(name, 0) + (int(count) if count else 1)
+    return heads
+
+
+def objective_breakdown(codes, labels, staff_names, shifts, daily_work_hours, total_work_hours=None,
+                        shift_compatibility=None, penalties=None):
+    # 全案の目的関数の内訳を (案 × 成分) の DataFrame で返す。
+    # 定義は shift_model の各成分と同じ（optimize_shifts と、拠点が1つの optimize_multi_site の重み付き目的に一致）
+    penalties = penalties or {}
+    weight_support = penalties.get("support_penalty", 1000)
+    weight_incompatible = penalties.get("shift_compat_penalty", 10)
+    weight_hours = penalties.get("workload_diff_penalty", 100)
+    weight_day_shift = penalties.get("day_shift_bonus", -1)
+
+    shift_labels = [s["label"] for s in shifts if s["label"] not in ["休み", "応援"]]
+    staff_rows = np.array([name != SUPPORT_STAFF_NAME for name in staff_names])
+    staff = codes[:, staff_rows]
+    names = [name for name in staff_names if name != SUPPORT_STAFF_NAME]
+
+    hours = staff_hours(staff, labels, names, shifts, daily_work_hours)
+    counts = label_counts(staff, len(labels))
+    code_of = {label: i for i, label in enumerate(labels)}
+    num_plans = codes.shape[0]
+
+    # 応援の延べ人数
+    heads = np.array([sum(parse_support(label).values()) for label in labels])
+    support = heads[codes[:, ~staff_rows]].sum(axis=(1, 2)) if (~staff_rows).any() else np.zeros(num_plans, dtype=int)
+
+    # 対応不可シフト（有給は休み扱い）
+    shift_compat = np.zeros(num_plans, dtype=int)
+    if shift_compatibility and names:
+        model_labels = np.array([
+            "休み" if label in ["有給", "休み"] else label if label in shift_labels else ""
+            for label in labels
+        ])
+        incompatible = np.array([
+            [bool(label) and label not in set(shift_compatibility.get(name.strip(), [])) for label in model_labels]
+            for name in names
+        ])
+        shift_compat = incompatible[np.arange(len(names))[None, :, None], staff].sum(axis=(1, 2))
+
+    # 目標勤務時間との差・日勤誘導
+    workload_diff = np.zeros(num_plans, dtype=int)
+    day_shift = np.zeros(num_plans, dtype=int)
+    if total_work_hours:
+        targets = np.array([total_work_hours.get(name) for name in names], dtype=object)
+        has_target = np.array([t is not None for t in targets])
+        target = np.array([int(t) if t is not None else 0 for t in targets])
+        workload_diff = (np.abs(hours - target) * has_target).sum(axis=1)
+        if "日勤" in code_of and "日勤" in shift_labels:
+            insufficient = (hours < target) & has_target
+            day_shift = (counts[:, :, code_of["日勤"]] * insufficient).sum(axis=1)
+
+    # シフト均等化（シフトごとの最多回数 − 最少回数）
+    shift_balance = np.zeros(num_plans, dtype=int)
+    if names:
+        for label in shift_labels:
+            count = counts[:, :, code_of[label]] if label in code_of else np.zeros((num_plans, len(names)), dtype=int)
+            shift_balance += count.max(axis=1) - count.min(axis=1)
+
+    breakdown = pd.DataFrame({
+        "support": support,
+        "shift_compat": shift_compat,
+        "workload_diff": workload_diff,
+        "shift_balance": shift_balance,
+        "day_shift": day_shift,
+    })
+    breakdown["total"] = (
+        weight_support * breakdown["support"]
+        + weight_incompatible * breakdown["shift_compat"]
+        + weight_hours * breakdown["workload_diff"]
+        + breakdown["shift_balance"]
+        + weight_day_shift * breakdown["day_shift"]
+    )
+    return breakdown[BREAKDOWN_COLUMNS]
+
+
+def staff_hours(codes, labels, staff_names, shifts, daily_work_hours):
+    # (案 × スタッフ × 日) → (案 × スタッフ) の勤務時間（有給は各スタッフの1日の勤務時間）
+    shift_hours = {s["label"]: s["hours"] for s in shifts}
+    label_hours = np.array([shift_hours.get(label, 0) if label else 0 for label in labels])
+    hours = label_hours[codes].sum(axis=2)
+    if "有給" in labels:
+        paid = (codes == labels.index("有給")).sum(axis=2)
+        daily = np.array([int(daily_work_hours.get(name, 0)) for name in staff_names])
+        hours = hours + paid * daily
+    return hours
+
+
+def label_counts(codes, num_labels):
+    # (案 × スタッフ × 日) → (案 × スタッフ × ラベル) の回数
+    num_plans, num_staff, _ = codes.shape
+    flat = (np.arange(num_plans * num_staff)[:, None] * num_labels + codes.reshape(num_plans * num_staff, -1))
+    counts = np.bincount(flat.ravel(), minlength=num_plans * num_staff * num_labels)
+    return counts.reshape(num_plans, num_staff, num_labels)
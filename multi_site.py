@@ -0,0 +1,277 @@
+from ortools.sat.python import cp_model
+import collections
+import time
+
+import shift_model
+import staged
+
+
+def optimize_multi_site(
+    sites,
+    staff_names,
+    staff_home_sites,
+    shifts,
+    dates,
+    required_staff,
+    leave_requests,
+    daily_work_hours,
+    total_work_hours=None,
+    shift_compatibility=None,
+    strict_staffing_days=None,
+    support_capacity=0,
+    lending_costs=None,
+    penalties=None,
+    work_rules=None,
+    objective_mode="weighted",
+    stage_order=None,
+    max_time_in_seconds=60.0,
+    num_workers=8,
+):
+    # 複数拠点（病棟）をひとつのモデルで最適化する
+    #   required_staff       : {拠点: {日付: {シフト: 必要人数}}}
+    #   staff_home_sites     : {スタッフ名: 所属拠点}
+    #   strict_staffing_days : {拠点: {日付: bool}}
+    #   support_capacity     : 1日あたりに全拠点で使える応援の延べ人数（プール）
+    #   lending_costs        : {(貸出元, 貸出先): 1人あたりのコスト}。None なら全拠点間で貸出可
+    #
+    # スタッフ個人の割当は拠点に依存しない x[s, d, sh] のみで持ち、
+    # 拠点間の貸し借りは (貸出元, 貸出先, 日, シフト) ごとの整数フロー変数で表す。
+    # 誰を貸し出すかは求解後に決めるため、スタッフ数 × 拠点数の変数を作らずに済む。
+    build_start = time.perf_counter()
+    model = cp_model.CpModel()
+
+    if penalties is None:
+        penalties = {}
+
+    weight_support = penalties.get("support_penalty", 1000)
+    weight_lending = penalties.get("lending_penalty", 50)
+    weight_incompatible = penalties.get("shift_compat_penalty", 10)
+    weight_hours = penalties.get("workload_diff_penalty", 100)
+    weight_day_shift = penalties.get("day_shift_bonus", -1)
+
+    # シフト定義
+    shift_labels, shift_hours = shift_model.shift_table(shifts)
+    normal_shifts = [label for label in shift_labels if label != "休み"]
+
+    shift_to_index = {label: i for i, label in enumerate(shift_labels)}
+    num_shifts = len(shift_labels)
+    rest_idx = shift_to_index["休み"]
+
+    num_staff = len(staff_names)
+    num_days = len(dates)
+    num_sites = len(sites)
+    site_to_index = {site: i for i, site in enumerate(sites)}
+
+    home = [site_to_index[staff_home_sites[name]] for name in staff_names]
+    staff_by_site = collections.defaultdict(list)
+    for s in range(num_staff):
+        staff_by_site[home[s]].append(s)
+
+    if lending_costs is None:
+        lending_costs = {
+            (a, b): weight_lending for a in sites for b in sites if a != b
+        }
+    lending_pairs = [
+        (site_to_index[a], site_to_index[b], int(cost))
+        for (a, b), cost in lending_costs.items()
+        if a != b
+    ]
+
+    def demand(j, d, sh_label):
+        return required_staff.get(sites[j], {}).get(dates[d], {}).get(sh_label, 0)
+
+    # 変数定義・スタッフ個人の制約（1日1シフト・勤務ルール・希望休/有給/希望シフト）
+    x = shift_model.new_assignment_vars(model, num_staff, num_days, num_shifts)
+    shift_model.add_staff_constraints(model, x, staff_names, dates, shift_labels, leave_requests, work_rules)
+
+    # どの拠点でも必要人数0のシフトには誰も入れない
+    for d in range(num_days):
+        for sh_label in normal_shifts:
+            if all(demand(j, d, sh_label) == 0 for j in range(num_sites)):
+                sh_idx = shift_to_index[sh_label]
+                for s in range(num_staff):
+                    model.Add(x[s, d, sh_idx] == 0)
+
+    lending_terms = []
+
+    # 拠点間の貸し借り（整数フロー）
+    lend = {}
+    for d in range(num_days):
+        for sh_label in normal_shifts:
+            for a, b, cost in lending_pairs:
+                if demand(b, d, sh_label) == 0 or not staff_by_site[a]:
+                    continue
+                var = model.NewIntVar(0, len(staff_by_site[a]), f"lend_{a}_{b}_{d}_{sh_label}")
+                lend[a, b, d, sh_label] = var
+                lending_terms.append(cost * var)
+
+    # 応援（全拠点で共有する人数枠）
+    support = {}
+    if support_capacity > 0:
+        for d in range(num_days):
+            for j in range(num_sites):
+                for sh_label in normal_shifts:
+                    if demand(j, d, sh_label) == 0:
+                        continue
+                    var = model.NewIntVar(0, support_capacity, f"support_{j}_{d}_{sh_label}")
+                    support[j, d, sh_label] = var
+            day_support = [v for (j, dd, _), v in support.items() if dd == d]
+            if day_support:
+                model.Add(sum(day_support) <= support_capacity)
+
+    # 必要人数制約（拠点ごと）
+    for d, date in enumerate(dates):
+        for sh_label in normal_shifts:
+            sh_idx = shift_to_index[sh_label]
+            for j in range(num_sites):
+                home_assigned = sum(x[s, d, sh_idx] for s in staff_by_site[j])
+                lent_out = [lend[j, b, d, sh_label] for a, b, _ in lending_pairs if a == j and (j, b, d, sh_label) in lend]
+                lent_in = [lend[a, j, d, sh_label] for a, b, _ in lending_pairs if b == j and (a, j, d, sh_label) in lend]
+
+                # 貸し出せるのは当日そのシフトに入っている自拠点スタッフまで
+                if lent_out:
+                    model.Add(sum(lent_out) <= home_assigned)
+
+                covered = home_assigned - sum(lent_out) + sum(lent_in)
+                if (j, d, sh_label) in support:
+                    covered += support[j, d, sh_label]
+
+                required = demand(j, d, sh_label)
+                is_strict = False
+                if strict_staffing_days:
+                    is_strict = strict_staffing_days.get(sites[j], {}).get(date, False)
+
+                if required == 0 or is_strict:
+                    model.Add(covered == required)
+                else:
+                    model.Add(covered >= required)
+
+    # 目的の各成分（定義は optimize_shifts と共通。シフト均等化だけは拠点ごと）
+    work_hours = shift_model.add_work_hours(
+        model, x, staff_names, dates, shift_hours, leave_requests, daily_work_hours
+    )
+    incompatible_terms = shift_model.incompatibility_terms(
+        x, staff_names, num_days, shift_labels, shift_compatibility
+    )
+    diff_vars = []
+    for j in range(num_sites):
+        diff_vars += shift_model.shift_balance_terms(
+            model, x, staff_by_site[j], num_days, shift_labels, tag=f"_{j}"
+        )
+    hour_diff_vars = shift_model.workload_diff_terms(model, work_hours, staff_names, total_work_hours)
+    day_shift_proxies = shift_model.day_shift_terms(
+        model, x, work_hours, staff_names, num_days, shift_labels, total_work_hours
+    )
+
+    # 目的関数の各成分（重み, 式）
+    objective_components = {
+        "support": (weight_support, sum(support.values())),
+        "lending": (1, sum(lending_terms)),
+        "shift_compat": (weight_incompatible, sum(incompatible_terms)),
+        "workload_diff": (weight_hours, sum(hour_diff_vars)),
+        "shift_balance": (1, sum(diff_vars)),
+        "day_shift": (weight_day_shift, sum(day_shift_proxies)),
+    }
+    model.Minimize(sum(weight * expr for weight, expr in objective_components.values()))
+
+    # 貪欲法で作った初期解をヒントとして渡す（大規模時の初回解探索を短縮）
+    hint_shift, hint_lend, hint_support = shift_model.greedy_roster(
+        staff_names, staff_home_sites, sites, normal_shifts, shift_hours, dates,
+        demand, leave_requests, total_work_hours, shift_compatibility,
+        lending_pairs, lend, support_capacity, support, shift_labels, work_rules,
+    )
+    for s in range(num_staff):
+        for d in range(num_days):
+            chosen = shift_to_index.get(hint_shift[s][d], rest_idx)
+            for sh in range(num_shifts):
+                model.AddHint(x[s, d, sh], sh == chosen)
+    for key, var in lend.items():
+        model.AddHint(var, hint_lend.get(key, 0))
+    for key, var in support.items():
+        model.AddHint(var, hint_support.get(key, 0))
+    build_time = time.perf_counter() - build_start
+
+    hint_time, _ = shift_model.complete_hint(model, min(shift_model.HINT_TIME_LIMIT, max_time_in_seconds / 10))
+    max_time_in_seconds = max(max_time_in_seconds - hint_time, 0.1)
+
+    num_variables = len(model.Proto().variables)
+    num_constraints = len(model.Proto().constraints)
+
+    # LNS 系のワーカーが大規模時の改善に効くので、コア数が少なくても複数ワーカーで回す
+    # （段階的最適化の各段も同じワーカー数で解く）
+    stage_report = None
+    if objective_mode == "staged":
+        solver, status, stage_report = staged.solve_staged(
+            model, staged.build_stages(objective_components, stage_order), max_time_in_seconds,
+            num_workers=num_workers
+        )
+        solve_time = sum(entry["time"] for entry in stage_report)
+    else:
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = max_time_in_seconds
+        solver.parameters.num_workers = num_workers
+        status = solver.Solve(model)
+        solve_time = solver.WallTime()
+
+    stats = {
+        "status": solver.StatusName(status),
+        "build_time": build_time,
+        "hint_time": hint_time,
+        "solve_time": solve_time,
+        "num_variables": num_variables,
+        "num_constraints": num_constraints,
+        "objective": None,
+        "best_bound": None,
+    }
+    if stage_report is not None:
+        stats["stages"] = stage_report
+
+    if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+        return {"roster": None, "placement": None, "support": None, "stats": stats}
+
+    # 段階的最適化では目的が段ごとに違うので、1つの目的値ではなく段ごとの値を返す
+    if stage_report is not None:
+        stats["stage_values"] = {entry["stage"]: entry["value"] for entry in stage_report}
+    else:
+        stats["objective"] = solver.ObjectiveValue()
+        stats["best_bound"] = solver.BestObjectiveBound()
+
+    # ----- 解の復元 -----
+    roster = collections.defaultdict(dict)
+    placement = collections.defaultdict(dict)
+    working = collections.defaultdict(list)
+    for s, name in enumerate(staff_names):
+        for d, date in enumerate(dates):
+            placement[name][date] = sites[home[s]]
+            if name in leave_requests and date in leave_requests[name].get("有給", []):
+                roster[name][date] = "有給"
+                continue
+            for sh in range(num_shifts):
+                if solver.Value(x[s, d, sh]) == 1:
+                    roster[name][date] = shift_labels[sh]
+                    if sh != rest_idx:
+                        working[home[s], d, shift_labels[sh]].append(s)
+                    break
+
+    # 貸出人数に合わせて貸出元のスタッフを順に割り当てる
+    for (a, b, d, sh_label), var in lend.items():
+        count = solver.Value(var)
+        if count == 0:
+            continue
+        candidates = working[a, d, sh_label]
+        for s in candidates[:count]:
+            placement[staff_names[s]][dates[d]] = sites[b]
+        working[a, d, sh_label] = candidates[count:]
+
+    support_result = collections.defaultdict(lambda: collections.defaultdict(dict))
+    for (j, d, sh_label), var in support.items():
+        count = solver.Value(var)
+        if count > 0:
+            support_result[sites[j]][dates[d]][sh_label] = count
+
+    return {
+        "roster": roster,
+        "placement": placement,
+        "support": support_result,
+        "stats": stats,
+    }
@@ -1,5 +1,11 @@
 from ortools.sat.python import cp_model
 import collections
+import time
+
+from constants import SUPPORT_STAFF_NAME
+import shift_model
+import staged
+
 
 def optimize_shifts(
     staff_names,
@@ -14,8 +20,17 @@ def optimize_shifts(
     strict_staffing_days=None,
     solution_index=0,
     max_solutions=10,
-    penalties=None
-    
+    penalties=None,
+    max_support_per_shift=None,
+    work_rules=None,
+    objective_mode="weighted",
+    stage_order=None,
+    stage_report=None,
+    max_time_in_seconds=10.0,
+    warm_start=None,
+    solution_pool=None,
+    solve_stats=None,
+    num_workers=8
 ):
     model = cp_model.CpModel()
 
@@ -28,196 +43,47 @@ def optimize_shifts(
     weight_day_shift = penalties.get("day_shift_bonus", -1)
     
     # シフト定義
-    shift_labels = [s["label"] for s in shifts]
-    shift_hours = [s["hours"] for s in shifts]
-
-    if "休み" not in shift_labels:
-        shift_labels.append("休み")
-        shift_hours.append(0)
-
-    if use_support_shift and "応援" not in shift_labels:
-        shift_labels.append("応援")
-        shift_hours.append(8)
-
+    shift_labels, shift_hours = shift_model.shift_table(shifts)
     shift_to_index = {label: i for i, label in enumerate(shift_labels)}
     num_shifts = len(shift_labels)
 
-    # 応援スタッフ追加（必要であれば）
-    support_staff_name = "（応援）臨時スタッフ"
-    if use_support_shift and support_staff_name not in staff_names:
-        staff_names = staff_names + [support_staff_name]
-        if shift_compatibility is not None:
-            shift_compatibility[support_staff_name] = ["応援", "休み"]
-
     num_staff = len(staff_names)
     num_days = len(dates)
 
-    support_idx = shift_to_index.get("応援", -1)
     rest_idx = shift_to_index["休み"]
-    support_staff_idx = staff_names.index(support_staff_name) if support_staff_name in staff_names else -1
-
-    # 変数定義
-    x = {}
-    for s in range(num_staff):
-        for d in range(num_days):
-            for sh in range(num_shifts):
-                x[s, d, sh] = model.NewBoolVar(f"x_{s}_{d}_{sh}")
-
-    # 各スタッフの各シフトの勤務日数を計算するIntVarを作成（応援スタッフ除く）
-    shift_counts = {}
-    for s in range(num_staff):
-        if s == support_staff_idx:
-            continue
-        for sh in range(num_shifts):
-            shift_counts[s, sh] = model.NewIntVar(0, num_days, f"shift_count_{s}_{sh}")
-            model.Add(shift_counts[s, sh] == sum(x[s, d, sh] for d in range(num_days)))
-
-    # 各スタッフの勤務時間合計（有給は勤務扱いで加算）を計算
-    work_hours_vars = {}
-    for s in range(num_staff):
-        if s == support_staff_idx:
-            continue
-    
-        name = staff_names[s]
-        daily_hour = daily_work_hours.get(name, 0)
-    
-        # 有給の勤務時間分を加算
-        extra_paid_hours = 0
-        if name in leave_requests:
-            for d, date in enumerate(dates):
-                if date in leave_requests[name].get("有給", []):
-                    extra_paid_hours += int(daily_hour)
-    
-        # 実働シフトによる勤務時間（有給以外）
-        work_hour_expr = sum(
-            x[s, d, sh] * shift_hours[sh]
-            for d in range(num_days)
-            for sh in range(num_shifts)
-        )
-    
-        # 合算（シフト勤務 + 有給分）
-        work_hours_vars[s] = model.NewIntVar(
-            0, num_days * max(shift_hours) + extra_paid_hours, f"work_hours_{s}"
-        )
-        model.Add(work_hours_vars[s] == work_hour_expr + extra_paid_hours)
+    normal_shifts = [label for label in shift_labels if label != "休み"]
 
-    # 各スタッフは1日1シフト
-    for s in range(num_staff):
-        for d in range(num_days):
-            model.AddExactlyOne(x[s, d, sh] for sh in range(num_shifts))
+    # 変数定義・スタッフ個人の制約（1日1シフト・勤務ルール・希望休/有給/希望シフト）
+    x = shift_model.new_assignment_vars(model, num_staff, num_days, num_shifts)
+    shift_model.add_staff_constraints(model, x, staff_names, dates, shift_labels, leave_requests, work_rules)
 
-    # 連続勤務最大6日制限
-    max_consecutive_work = 6
-    for s in range(num_staff):
-        if s == support_staff_idx:
-            continue
-        for start_day in range(num_days - max_consecutive_work):
-            work_flags = [1 - x[s, d, rest_idx] for d in range(start_day, start_day + max_consecutive_work + 1)]
-            model.Add(sum(work_flags) <= max_consecutive_work)
-
-    # 応援スタッフ制約
-    if use_support_shift and support_staff_idx >= 0:
-        for d in range(num_days):
-            for sh in range(num_shifts):
-                if sh not in [support_idx, rest_idx]:
-                    model.Add(x[support_staff_idx, d, sh] == 0)
-
-        for s in range(num_staff):
-            if s == support_staff_idx:
-                continue
-            for d in range(num_days):
-                model.Add(x[s, d, support_idx] == 0)
-
-    # 希望休・有給・希望シフト
-    for s, name in enumerate(staff_names):
-        if s == support_staff_idx:
-            continue
+    # 応援：(日, シフト) ごとに追加できる人数を整数変数で持つ
+    support_vars = {}
+    support_upper = {}
+    if use_support_shift:
         for d, date in enumerate(dates):
-            if name in leave_requests:
-                if date in leave_requests[name].get("希望休", []) or date in leave_requests[name].get("有給", []):
-                    model.Add(x[s, d, rest_idx] == 1)
-                shift_pref = leave_requests[name].get("シフト希望", {}).get(date)
-                if shift_pref and shift_pref in shift_to_index:
-                    model.Add(x[s, d, shift_to_index[shift_pref]] == 1)
-
-    # 必要人数と応援
-    objective_terms = []
-    covers_map = collections.defaultdict(list)
-    support_label = "応援"
-    normal_shifts = [label for label in shift_labels if label not in [support_label, "休み"]]
-
-    if use_support_shift and support_label in shift_labels:
-        for sh_label in normal_shifts:
-            covers_map[sh_label].append(support_label)
-
-    support_cover_vars = {}
-    for d in range(num_days):
-        for sh_label in normal_shifts:
-            support_cover_vars[(d, sh_label)] = model.NewBoolVar(f"support_cover_{d}_{sh_label}")
-
-    for d in range(num_days):
-        if support_staff_idx >= 0:
-            x_support = x[support_staff_idx, d, support_idx]
+            shift_req = required_staff.get(date, {})
             for sh_label in normal_shifts:
-                model.Add(support_cover_vars[(d, sh_label)] <= x_support)
-            model.Add(sum(support_cover_vars[(d, sh_label)] for sh_label in normal_shifts) <= 1)
-
-        # 対応不可シフト：避けるが絶対禁止ではない（ソフト制約化）
-    if shift_compatibility:
-        for s, name in enumerate(staff_names):
-            allowed_shifts = set(shift_compatibility.get(name.strip(), []))
-            for d in range(num_days):
-                for sh_idx, label in enumerate(shift_labels):
-                    if label not in allowed_shifts:
-                        penalty_var = model.NewBoolVar(f"incompatible_{s}_{d}_{sh_idx}")
-                        model.Add(x[s, d, sh_idx] == 1).OnlyEnforceIf(penalty_var)
-                        model.Add(x[s, d, sh_idx] == 0).OnlyEnforceIf(penalty_var.Not())
-                        objective_terms.append(weight_incompatible * penalty_var)  # 重み10は調整可能
-
-    
-    # シフト均等化
-    diff_vars = []
-    for sh in range(num_shifts):
-        if shift_labels[sh] in ["休み", "応援"]:
-            continue
-        max_count = model.NewIntVar(0, num_days, f"max_count_{sh}")
-        min_count = model.NewIntVar(0, num_days, f"min_count_{sh}")
-        model.AddMaxEquality(max_count, [shift_counts[s, sh] for s in range(num_staff) if s != support_staff_idx])
-        model.AddMinEquality(min_count, [shift_counts[s, sh] for s in range(num_staff) if s != support_staff_idx])
-        diff = model.NewIntVar(0, num_days, f"diff_{sh}")
-        model.Add(diff == max_count - min_count)
-        diff_vars.append(diff)
-
-    # 勤務時間の目標との差（ソフト制約）
-    if total_work_hours:
-        for s in range(num_staff):
-            if s == support_staff_idx:
-                continue
-            target = total_work_hours.get(staff_names[s], None)
-            if target is not None:
-                diff_var = model.NewIntVar(0, num_days * max(shift_hours), f"work_diff_{s}")
-                model.Add(diff_var >= work_hours_vars[s] - int(target))
-                model.Add(diff_var >= int(target) - work_hours_vars[s])
-                objective_terms.append(weight_hours * diff_var)
-
-    # 日勤誘導
-    alpha = 1
-    day_shift_idx = shift_to_index.get("日勤")
-    if day_shift_idx is not None:
-        for s in range(num_staff):
-            if s == support_staff_idx:
-                continue
-            day_shift_count = model.NewIntVar(0, num_days, f"day_shift_count_{s}")
-            model.Add(day_shift_count == sum(x[s, d, day_shift_idx] for d in range(num_days)))
-            if total_work_hours:
-                target = total_work_hours.get(staff_names[s], None)
-                if target is not None:
-                    insufficient = model.NewBoolVar(f"insufficient_{s}")
-                    model.Add(work_hours_vars[s] < int(target)).OnlyEnforceIf(insufficient)
-                    model.Add(work_hours_vars[s] >= int(target)).OnlyEnforceIf(insufficient.Not())
-                    proxy = model.NewIntVar(0, num_days, f"proxy_day_shift_{s}")
-                    model.AddMultiplicationEquality(proxy, [day_shift_count, insufficient])
-                    objective_terms.append(weight_day_shift * proxy)
+                required = shift_req.get(sh_label, 0)
+                if required == 0:
+                    continue
+                upper = required if max_support_per_shift is None else min(required, max_support_per_shift)
+                if upper > 0:
+                    support_vars[d, sh_label] = model.NewIntVar(0, upper, f"support_{d}_{sh_label}")
+                    support_upper[d, sh_label] = upper
+
+    # 目的の各成分（定義は optimize_multi_site と共通）
+    work_hours = shift_model.add_work_hours(
+        model, x, staff_names, dates, shift_hours, leave_requests, daily_work_hours
+    )
+    incompatible_vars = shift_model.incompatibility_terms(
+        x, staff_names, num_days, shift_labels, shift_compatibility
+    )
+    diff_vars = shift_model.shift_balance_terms(model, x, range(num_staff), num_days, shift_labels)
+    hour_diff_vars = shift_model.workload_diff_terms(model, work_hours, staff_names, total_work_hours)
+    day_shift_proxies = shift_model.day_shift_terms(
+        model, x, work_hours, staff_names, num_days, shift_labels, total_work_hours
+    )
 
     # 必要人数制約
     for d, date in enumerate(dates):
@@ -230,67 +96,168 @@ def optimize_shifts(
             required = shift_req.get(sh_label, 0)
             sh_idx = shift_to_index[sh_label]
     
-            if required == 0 and sh_label != "応援":
+            if required == 0:
                 for s in range(num_staff):
                     model.Add(x[s, d, sh_idx] == 0)
                 continue
     
-            assigned_main = sum(x[s, d, sh_idx] for s in range(num_staff) if s != support_staff_idx)
-            cover_total = 0
-            for cover_label in covers_map.get(sh_label, []):
-                if cover_label == support_label:
-                    cover_total += support_cover_vars[(d, sh_label)]
-                else:
-                    cover_idx = shift_to_index[cover_label]
-                    cover_total += sum(x[s, d, cover_idx] for s in range(num_staff))
+            assigned_main = sum(x[s, d, sh_idx] for s in range(num_staff))
+            cover_total = support_vars.get((d, sh_label), 0)
     
             if is_strict:
                 model.Add(assigned_main + cover_total == required)
             else:
                 model.Add(assigned_main + cover_total >= required)
 
-    if support_staff_idx >= 0:
-        total_support_assign = model.NewIntVar(0, num_days, "total_support_assign")
-        model.Add(total_support_assign == sum(x[support_staff_idx, d, support_idx] for d in range(num_days)))
-        model.Minimize(weight_support * total_support_assign + sum(diff_vars) + sum(objective_terms))
+    # 目的関数の各成分（重み, 式）
+    objective_components = {
+        "support": (weight_support, sum(support_vars.values())),
+        "shift_compat": (weight_incompatible, sum(incompatible_vars)),
+        "workload_diff": (weight_hours, sum(hour_diff_vars)),
+        "shift_balance": (1, sum(diff_vars)),
+        "day_shift": (weight_day_shift, sum(day_shift_proxies)),
+    }
+
+    # 過去の解をヒントにする（warm start）。有給は休み扱い、応援などの表示行は無視。
+    # 過去の解がなければ貪欲法で作った初期解をヒントにする（大規模時の初回解探索を短縮）
+    if warm_start:
+        for s, name in enumerate(staff_names):
+            for d, date in enumerate(dates):
+                label = warm_start.get(name, {}).get(date)
+                if label == "有給":
+                    label = "休み"
+                if label not in shift_to_index:
+                    continue
+                for sh in range(num_shifts):
+                    model.AddHint(x[s, d, sh], sh == shift_to_index[label])
     else:
-        model.Minimize(sum(diff_vars) + sum(objective_terms))
+        hint_shift, _, hint_support = shift_model.greedy_roster(
+            staff_names, {name: "" for name in staff_names}, [""], normal_shifts, shift_hours, dates,
+            lambda j, d, sh_label: required_staff.get(dates[d], {}).get(sh_label, 0),
+            leave_requests, total_work_hours, shift_compatibility, [], {},
+            sum(support_upper.values()),
+            {(0, d, sh_label): var for (d, sh_label), var in support_vars.items()},
+            shift_labels, work_rules,
+        )
+        for s in range(num_staff):
+            for d in range(num_days):
+                chosen = shift_to_index.get(hint_shift[s][d], rest_idx)
+                for sh in range(num_shifts):
+                    model.AddHint(x[s, d, sh], sh == chosen)
+        for (d, sh_label), var in support_vars.items():
+            model.AddHint(var, min(hint_support.get((0, d, sh_label), 0), support_upper[d, sh_label]))
+
+    # 重み付きの目的は先に設定しておき、ヒントの目的値も求めておく
+    if objective_mode != "staged":
+        model.Minimize(sum(weight * expr for weight, expr in objective_components.values()))
+
+    hint_time, hint_response = shift_model.complete_hint(model, min(shift_model.HINT_TIME_LIMIT, max_time_in_seconds / 10))
+    max_time_in_seconds = max(max_time_in_seconds - hint_time, 0.1)
+
+    # ----- 解の復元 -----
+    def extract_solution(value):
+        current_solution = collections.defaultdict(dict)
+        for s, name in enumerate(staff_names):
+            for d, date in enumerate(dates):
+                # 有給を明示的に "有給" にしておく（表示の整合性確保）
+                if name in leave_requests and date in leave_requests[name].get("有給", []):
+                    current_solution[name][date] = "有給"
+                    continue
+                for sh in range(num_shifts):
+                    if value(x[s, d, sh]) == 1:
+                        current_solution[name][date] = shift_labels[sh]
+        # 応援は臨時スタッフ行にまとめて表示（例: "応援(日勤×2・夜勤)"）
+        if support_vars:
+            for d, date in enumerate(dates):
+                used = [
+                    (sh_label, value(support_vars[d, sh_label]))
+                    for sh_label in normal_shifts
+                    if (d, sh_label) in support_vars
+                ]
+                used = [(sh_label, n) for sh_label, n in used if n > 0]
+                if used:
+                    detail = "・".join(sh_label if n == 1 else f"{sh_label}×{n}" for sh_label, n in used)
+                    current_solution[SUPPORT_STAFF_NAME][date] = f"応援({detail})"
+                else:
+                    current_solution[SUPPORT_STAFF_NAME][date] = "休み"
+        return current_solution
 
     # ----- 複数解収集ロジック -----
+    # 改善解ごとに呼ばれるので、後から見つかった（良い）解を max_solutions 件だけ残す。
+    # コールバック内では値の列だけ写し、シフト表への復元は残った解についてだけ行う
     class SolutionCollector(cp_model.CpSolverSolutionCallback):
         def __init__(self):
             cp_model.CpSolverSolutionCallback.__init__(self)
-            self.solutions = []
-            self.solution_count = 0
+            self.found = collections.deque(maxlen=max_solutions)
 
         def on_solution_callback(self):
-            if self.solution_count >= max_solutions:
-                return
-            current_solution = collections.defaultdict(dict)
-            for s, name in enumerate(staff_names):
-                for d, date in enumerate(dates):
-                    # 有給を明示的に "有給" にしておく（表示の整合性確保）
-                    if name in leave_requests and date in leave_requests[name].get("有給", []):
-                        current_solution[name][date] = "有給"
-                        continue
-                    for sh in range(num_shifts):
-                        if self.Value(x[s, d, sh]) == 1:
-                            current_solution[name][date] = shift_labels[sh]
-            self.solutions.append(current_solution)
-            self.solution_count += 1
+            # 段階的最適化では最終段の目的値にしかならないので記録しない
+            objective = self.ObjectiveValue() if objective_mode != "staged" else None
+            self.found.append((list(self.response_proto.solution), objective))
 
     # solver 初期化・複数解探索
     collector = SolutionCollector()
-    solver = cp_model.CpSolver()
-    solver.parameters.enumerate_all_solutions = True
-    solver.parameters.max_time_in_seconds = 10.0
-    status = solver.Solve(model, collector)
+    solve_start = time.perf_counter()
+    if objective_mode == "staged":
+        # 優先順位の高い目的から順に最適化する（重みは符号と 0 による無効化だけに使う）
+        solver, status, report = staged.solve_staged(
+            model, staged.build_stages(objective_components, stage_order), max_time_in_seconds,
+            collector, num_workers=num_workers
+        )
+        if stage_report is not None:
+            stage_report.extend(report)
+        # 最終段が時間切れのときは、最後に解けた段の解を返す
+        if status in [cp_model.OPTIMAL, cp_model.FEASIBLE] and not collector.found:
+            collector.found.append((list(solver.ResponseProto().solution), None))
+    else:
+        # 目的関数があると改善解ごとにコールバックが呼ばれる（enumerate_all_solutions は presolve を
+        # 止めてしまい解の候補がかえって減るので使わない）
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = max_time_in_seconds
+        # LNS 系のワーカーが大規模時の改善に効くので、コア数が少なくても複数ワーカーで回す
+        solver.parameters.num_workers = num_workers
+        status = solver.Solve(model, collector)
+
+    # 大規模時は presolve だけで持ち時間を使い切ることがある。ヒントが解として成り立っていればそれを返す
+    from_hint = status not in [cp_model.OPTIMAL, cp_model.FEASIBLE] and hint_response is not None
+    if from_hint:
+        collector.found.append((
+            list(hint_response.solution),
+            hint_response.objective_value if objective_mode != "staged" else None,
+        ))
+        status = cp_model.FEASIBLE
+
+    # 良い順（最後に見つかった解が先頭）に並べてシフト表へ復元する
+    found = list(reversed(collector.found))
+    solutions = [extract_solution(lambda var, values=values: values[var.Index()]) for values, _ in found]
+
+    # 求解の結果（保存・表示用）
+    if solve_stats is not None:
+        solve_stats.update({
+            "status": solver.StatusName(status),
+            "objective": None,
+            "best_bound": None,
+            "solve_time": time.perf_counter() - solve_start,
+            "hint_time": hint_time,
+            "pool_objectives": [objective for _, objective in found],
+        })
+        if objective_mode == "staged":
+            solve_stats["stage_values"] = {entry["stage"]: entry["value"] for entry in report}
+        elif from_hint:
+            solve_stats["objective"] = hint_response.objective_value
+        elif status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            solve_stats["objective"] = solver.ObjectiveValue()
+            solve_stats["best_bound"] = solver.BestObjectiveBound()
 
     if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
         return None
 
-    if solution_index >= collector.solution_count:
+    # 見つかった解をすべて受け取りたい場合（案の切替・比較用）
+    if solution_pool is not None:
+        solution_pool.extend(solutions)
+
+    if solution_index >= len(solutions):
         return None
 
-    return collector.solutions[solution_index]
+    return solutions[solution_index]
 
@@ -0,0 +1,167 @@
+import collections
+
+# 勤務ルールの既定値
+#   max_consecutive_work    : 連続勤務の上限日数
+#   min_consecutive_work    : 連続勤務の下限日数（期間の最初と最後の連続勤務は対象外）
+#   min_rest_after          : {シフト: 日数} そのシフトの翌日から必要な休みの日数（例: 夜勤明けの休み）
+#   forbidden_sequences     : 禁止するシフトの並び（例: [["夜勤", "日勤"]]）
+#   max_work_days_per_week  : 任意の連続7日間の勤務日数の上限
+#   staff                   : {スタッフ名: {上記キー: 値}} スタッフ個別の上書き
+DEFAULT_WORK_RULES = {
+    "max_consecutive_work": 6,
+    "min_consecutive_work": None,
+    "min_rest_after": {},
+    "forbidden_sequences": [],
+    "max_work_days_per_week": None,
+}
+
+# 勤務パターンを受理するオートマトン（状態は 0 始まりの連番、0 が初期状態）
+# 系列ルールを1日ずつ判定できるので、貪欲法の初期解作成に使う。
+# 期間の長さを知らないため、期間の最後の (下限−1) 日に始まる短い連続勤務はモデルでは許されるが
+# オートマトンでは拒否する（モデルより厳しい判定。受理した並びはモデルでも必ず成り立つ）
+WorkAutomaton = collections.namedtuple("WorkAutomaton", ["num_states", "transitions"])
+
+
+def resolve_work_rules(work_rules, name):
+    rule = dict(DEFAULT_WORK_RULES)
+    if work_rules:
+        rule.update({k: v for k, v in work_rules.items() if k != "staff"})
+        rule.update(work_rules.get("staff", {}).get(name, {}))
+    return rule
+
+
+def work_rule_errors(work_rules):
+    # 互いに矛盾して必ず解なしになる設定の一覧（全体と各スタッフの上書きそれぞれについて調べる）
+    errors = []
+    names = [None] + list((work_rules or {}).get("staff", {}))
+    for name in names:
+        rule = resolve_work_rules(work_rules, name)
+        min_work = rule.get("min_consecutive_work") or 0
+        max_work = rule.get("max_consecutive_work")
+        weekly_cap = rule.get("max_work_days_per_week")
+        target = "全体" if name is None else name
+        if max_work and min_work > max_work:
+            errors.append(f"{target}: 連続勤務の下限（{min_work}日）が上限（{max_work}日）を超えています")
+        if weekly_cap is not None and min_work > weekly_cap:
+            errors.append(f"{target}: 連続勤務の下限（{min_work}日）が7日間の勤務日数上限（{weekly_cap}日）を超えています")
+    return errors
+
+
+def compile_work_automaton(rule, shift_labels, rest_label="休み"):
+    # 系列ルール（連続勤務の上下限・明けの休み・禁止並び）をまとめて1つのオートマトンにする。
+    # 状態 = (連続勤務日数, 最初の連続勤務中か, 残りの必須休み日数, 直近のシフト履歴)
+    max_work = rule.get("max_consecutive_work")
+    min_work = rule.get("min_consecutive_work") or 0
+    rest_after = {
+        label: days for label, days in (rule.get("min_rest_after") or {}).items()
+        if label in shift_labels and days > 0
+    }
+    forbidden = [
+        tuple(seq) for seq in (rule.get("forbidden_sequences") or [])
+        if len(seq) >= 2 and all(label in shift_labels for label in seq)
+    ]
+    history_len = max((len(seq) for seq in forbidden), default=1) - 1
+    count_cap = max_work if max_work else max(min_work, 1)
+    track_first_run = min_work > 1
+
+    def step(state, label):
+        count, first_run, rest_left, history = state
+        window = history + (label,)
+        for seq in forbidden:
+            if window[-len(seq):] == seq:
+                return None
+        history = window[-history_len:] if history_len else ()
+
+        if label == rest_label:
+            if not first_run and 0 < count < min_work:
+                return None
+            return (0, False, max(rest_left - 1, 0), history)
+
+        if rest_left > 0:
+            return None
+        count += 1
+        if max_work and count > max_work:
+            return None
+        return (min(count, count_cap), first_run, rest_after.get(label, 0), history)
+
+    initial = (0, track_first_run, 0, ())
+    state_ids = {initial: 0}
+    transitions = {}
+    queue = collections.deque([initial])
+    while queue:
+        state = queue.popleft()
+        for sh, label in enumerate(shift_labels):
+            next_state = step(state, label)
+            if next_state is None:
+                continue
+            if next_state not in state_ids:
+                state_ids[next_state] = len(state_ids)
+                queue.append(next_state)
+            transitions[state_ids[state], sh] = state_ids[next_state]
+
+    return WorkAutomaton(len(state_ids), transitions)
+
+
+def add_work_rules(model, x, staff_names, num_days, shift_labels, work_rules=None, rest_label="休み"):
+    # 勤務日数の累積和 prefix[d]（d 日目より前の勤務日数）をスタッフごとに1本だけ作り、
+    # 連続勤務・週上限の窓はすべて2〜4項の差で表す。明けの休みと禁止並びは節（clause）にする。
+    # いずれも1日あたり定数サイズなので、ルールを増やしても窓長に比例して大きくならない。
+    # （AddAutomaton は presolve で展開されてヒントが効かなくなるため、モデルには使わない）
+    rest_idx = shift_labels.index(rest_label)
+    shift_to_index = {label: i for i, label in enumerate(shift_labels)}
+
+    for s, name in enumerate(staff_names):
+        rule = resolve_work_rules(work_rules, name)
+        max_work = rule.get("max_consecutive_work")
+        min_work = rule.get("min_consecutive_work") or 0
+        weekly_cap = rule.get("max_work_days_per_week")
+
+        prefix = None
+        if max_work or min_work > 1 or weekly_cap is not None:
+            prefix = [0]
+            for d in range(num_days):
+                var = model.NewIntVar(0, d + 1, f"work_prefix_{s}_{d}")
+                model.Add(var == prefix[-1] + 1 - x[s, d, rest_idx])
+                prefix.append(var)
+
+        # 連続勤務の上限：任意の (上限+1) 日間に1日は休み
+        if max_work:
+            for start_day in range(num_days - max_work):
+                model.Add(prefix[start_day + max_work + 1] - prefix[start_day] <= max_work)
+
+        # 連続勤務の下限：勤務が始まった日から下限日数は続ける（期間の最初と最後は対象外）
+        if min_work > 1:
+            for d in range(1, num_days - min_work + 1):
+                run_start = x[s, d - 1, rest_idx] - x[s, d, rest_idx]
+                model.Add(min_work * run_start <= prefix[d + min_work] - prefix[d])
+
+        # 任意の連続7日間の勤務日数上限
+        if weekly_cap is not None and weekly_cap < min(7, num_days):
+            for start_day in range(max(num_days - 7, 0) + 1):
+                model.Add(prefix[min(start_day + 7, num_days)] - prefix[start_day] <= weekly_cap)
+
+        # 指定シフトの翌日から所定日数は休み
+        for label, days in (rule.get("min_rest_after") or {}).items():
+            if label not in shift_to_index or days <= 0:
+                continue
+            sh_idx = shift_to_index[label]
+            for d in range(num_days):
+                for offset in range(1, days + 1):
+                    if d + offset < num_days:
+                        model.AddImplication(x[s, d, sh_idx], x[s, d + offset, rest_idx])
+
+        # 禁止並び：並び全体が同時に成り立たない
+        for seq in rule.get("forbidden_sequences") or []:
+            if len(seq) < 2 or any(label not in shift_to_index for label in seq):
+                continue
+            for d in range(num_days - len(seq) + 1):
+                model.AddBoolOr([x[s, d + i, shift_to_index[label]].Not() for i, label in enumerate(seq)])
+
+
+def work_rule_key(rule):
+    return (
+        rule.get("max_consecutive_work"),
+        rule.get("min_consecutive_work"),
+        tuple(sorted((rule.get("min_rest_after") or {}).items())),
+        tuple(tuple(seq) for seq in (rule.get("forbidden_sequences") or [])),
+    )
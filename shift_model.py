@@ -0,0 +1,278 @@
+from ortools.sat.python import cp_model
+import collections
+
+import rules
+
+# optimize_shifts と optimize_multi_site で共通のモデル部品。
+# 目的関数の各成分の定義はここだけに置き、evaluate.objective_breakdown も同じ定義で採点する。
+
+# ヒント補完（変数を固定した短い求解）の持ち時間の上限
+HINT_TIME_LIMIT = 5.0
+
+
+def shift_table(shifts):
+    # モデルで使うシフトの並びと時間（"応援" は表示用なので除き、"休み" がなければ末尾に足す）
+    shift_labels = [s["label"] for s in shifts if s["label"] != "応援"]
+    shift_hours = [s["hours"] for s in shifts if s["label"] != "応援"]
+    if "休み" not in shift_labels:
+        shift_labels.append("休み")
+        shift_hours.append(0)
+    return shift_labels, shift_hours
+
+
+def new_assignment_vars(model, num_staff, num_days, num_shifts):
+    x = {}
+    for s in range(num_staff):
+        for d in range(num_days):
+            for sh in range(num_shifts):
+                x[s, d, sh] = model.NewBoolVar(f"x_{s}_{d}_{sh}")
+    return x
+
+
+def add_staff_constraints(model, x, staff_names, dates, shift_labels, leave_requests, work_rules):
+    shift_to_index = {label: i for i, label in enumerate(shift_labels)}
+    rest_idx = shift_to_index["休み"]
+    num_days = len(dates)
+
+    # 各スタッフは1日1シフト
+    for s in range(len(staff_names)):
+        for d in range(num_days):
+            model.AddExactlyOne(x[s, d, sh] for sh in range(len(shift_labels)))
+
+    # 勤務ルール（連続勤務・明けの休み・禁止並び・週上限。既定は連続勤務最大6日）
+    rules.add_work_rules(model, x, staff_names, num_days, shift_labels, work_rules)
+
+    # 希望休・有給・希望シフト
+    for s, name in enumerate(staff_names):
+        if name not in leave_requests:
+            continue
+        for d, date in enumerate(dates):
+            if date in leave_requests[name].get("希望休", []) or date in leave_requests[name].get("有給", []):
+                model.Add(x[s, d, rest_idx] == 1)
+            shift_pref = leave_requests[name].get("シフト希望", {}).get(date)
+            if shift_pref and shift_pref in shift_to_index:
+                model.Add(x[s, d, shift_to_index[shift_pref]] == 1)
+
+
+def add_work_hours(model, x, staff_names, dates, shift_hours, leave_requests, daily_work_hours):
+    # 各スタッフの勤務時間合計（有給は各スタッフの1日の勤務時間で加算）。{s: (変数, 上限)} を返す
+    num_days = len(dates)
+    work_hours = {}
+    for s, name in enumerate(staff_names):
+        daily_hour = daily_work_hours.get(name, 0)
+        extra_paid_hours = 0
+        if name in leave_requests:
+            extra_paid_hours = int(daily_hour) * sum(
+                1 for date in dates if date in leave_requests[name].get("有給", [])
+            )
+        upper = num_days * max(shift_hours) + extra_paid_hours
+        var = model.NewIntVar(0, upper, f"work_hours_{s}")
+        model.Add(
+            var
+            == sum(x[s, d, sh] * shift_hours[sh] for d in range(num_days) for sh in range(len(shift_hours)))
+            + extra_paid_hours
+        )
+        work_hours[s] = (var, upper)
+    return work_hours
+
+
+def incompatibility_terms(x, staff_names, num_days, shift_labels, shift_compatibility):
+    # 対応不可シフト：避けるが絶対禁止ではない（ソフト制約化）。割当そのものをペナルティにする。
+    # 対応可能なシフトの一覧にないものはすべて対象（一覧のないスタッフ・一覧にない "休み" も含む）
+    terms = []
+    if not shift_compatibility:
+        return terms
+    for s, name in enumerate(staff_names):
+        allowed_shifts = set(shift_compatibility.get(name.strip(), []))
+        for sh_idx, label in enumerate(shift_labels):
+            if label in allowed_shifts:
+                continue
+            for d in range(num_days):
+                terms.append(x[s, d, sh_idx])
+    return terms
+
+
+def shift_balance_terms(model, x, members, num_days, shift_labels, tag=""):
+    # シフト均等化（休み以外のシフトごとの最多回数 − 最少回数）
+    terms = []
+    if len(members) < 2:
+        return terms
+    for sh_idx, label in enumerate(shift_labels):
+        if label == "休み":
+            continue
+        counts = []
+        for s in members:
+            count = model.NewIntVar(0, num_days, f"shift_count_{s}_{sh_idx}")
+            model.Add(count == sum(x[s, d, sh_idx] for d in range(num_days)))
+            counts.append(count)
+        max_count = model.NewIntVar(0, num_days, f"max_count{tag}_{sh_idx}")
+        min_count = model.NewIntVar(0, num_days, f"min_count{tag}_{sh_idx}")
+        model.AddMaxEquality(max_count, counts)
+        model.AddMinEquality(min_count, counts)
+        terms.append(max_count - min_count)
+    return terms
+
+
+def workload_diff_terms(model, work_hours, staff_names, total_work_hours):
+    # 勤務時間の目標との差（ソフト制約）。
+    # 下限だけだと途中解の目的値に余りが出るので、差の絶対値に一致させる
+    terms = []
+    if not total_work_hours:
+        return terms
+    for s, name in enumerate(staff_names):
+        target = total_work_hours.get(name, None)
+        if target is None:
+            continue
+        var, upper = work_hours[s]
+        diff_var = model.NewIntVar(0, upper + int(target), f"work_diff_{s}")
+        model.AddAbsEquality(diff_var, var - int(target))
+        terms.append(diff_var)
+    return terms
+
+
+def day_shift_terms(model, x, work_hours, staff_names, num_days, shift_labels, total_work_hours):
+    # 日勤誘導：目標時間に届かないスタッフの日勤回数
+    terms = []
+    if "日勤" not in shift_labels or not total_work_hours:
+        return terms
+    day_shift_idx = shift_labels.index("日勤")
+    for s, name in enumerate(staff_names):
+        target = total_work_hours.get(name, None)
+        if target is None:
+            continue
+        var, _ = work_hours[s]
+        insufficient = model.NewBoolVar(f"insufficient_{s}")
+        model.Add(var < int(target)).OnlyEnforceIf(insufficient)
+        model.Add(var >= int(target)).OnlyEnforceIf(insufficient.Not())
+        # proxy = 日勤回数 × insufficient を線形の不等式で表す
+        day_shift_count = sum(x[s, d, day_shift_idx] for d in range(num_days))
+        proxy = model.NewIntVar(0, num_days, f"proxy_day_shift_{s}")
+        model.Add(proxy <= day_shift_count)
+        model.Add(proxy <= num_days * insufficient)
+        model.Add(proxy >= day_shift_count - num_days * (1 - insufficient))
+        terms.append(proxy)
+    return terms
+
+
+def greedy_roster(
+    staff_names, staff_home_sites, sites, normal_shifts, shift_hours, dates,
+    demand, leave_requests, total_work_hours, shift_compatibility,
+    lending_pairs, lend, support_capacity, support, shift_labels, work_rules,
+):
+    # 日付順に、目標時間に対して不足の大きいスタッフから必要人数を埋めていく。
+    # 足りない分は貸出コストの安い拠点から借り、それでも足りなければ応援枠を使う。
+    # 勤務ルールはオートマトン（モデルより厳しい判定）で状態を追って守る（連続勤務下限は優先度で寄せるのみ）。
+    num_staff = len(staff_names)
+    site_to_index = {site: i for i, site in enumerate(sites)}
+    home = [site_to_index[staff_home_sites[name]] for name in staff_names]
+    label_hours = {label: h for label, h in zip(shift_labels, shift_hours) if label in normal_shifts}
+    shift_to_index = {label: i for i, label in enumerate(shift_labels)}
+    rest_idx = shift_to_index["休み"]
+    targets = [
+        (total_work_hours or {}).get(name, 0) or 0 for name in staff_names
+    ]
+    allowed = [
+        set((shift_compatibility or {}).get(name.strip(), [])) for name in staff_names
+    ]
+
+    automata = {}
+    staff_automata = []
+    weekly_caps = []
+    for name in staff_names:
+        rule = rules.resolve_work_rules(work_rules, name)
+        key = rules.work_rule_key(rule)
+        if key not in automata:
+            automata[key] = rules.compile_work_automaton(rule, shift_labels)
+        staff_automata.append(automata[key].transitions)
+        weekly_caps.append(rule.get("max_work_days_per_week"))
+
+    hint_shift = [["休み"] * len(dates) for _ in range(num_staff)]
+    hint_lend = {}
+    hint_support = {}
+    hours = [0] * num_staff
+    states = [0] * num_staff
+    recent_work = [collections.deque(maxlen=6) for _ in range(num_staff)]
+
+    def can_work(s, sh_label):
+        if (states[s], shift_to_index[sh_label]) not in staff_automata[s]:
+            return False
+        return weekly_caps[s] is None or sum(recent_work[s]) < weekly_caps[s]
+
+    for d, date in enumerate(dates):
+        available = collections.defaultdict(list)
+        covered = collections.Counter()
+        for s, name in enumerate(staff_names):
+            requests = leave_requests.get(name, {})
+            if date in requests.get("希望休", []) or date in requests.get("有給", []):
+                continue
+            shift_pref = requests.get("シフト希望", {}).get(date)
+            if shift_pref in label_hours:
+                hint_shift[s][d] = shift_pref
+                covered[home[s], shift_pref] += 1
+            elif any(can_work(s, sh_label) for sh_label in normal_shifts):
+                available[home[s]].append(s)
+
+        # 休めない状態（連続勤務下限の途中）のスタッフを先に使う
+        for j in available:
+            available[j].sort(key=lambda s: ((states[s], rest_idx) in staff_automata[s], hours[s] - targets[s]))
+
+        def take(j, sh_label, count):
+            candidates = [s for s in available[j] if can_work(s, sh_label)]
+            chosen = [s for s in candidates if sh_label in allowed[s]][:count]
+            if len(chosen) < count:
+                chosen += [s for s in candidates if sh_label not in allowed[s]][:count - len(chosen)]
+            for s in chosen:
+                hint_shift[s][d] = sh_label
+            chosen_set = set(chosen)
+            available[j] = [s for s in available[j] if s not in chosen_set]
+            return len(chosen)
+
+        shortage = {}
+        for sh_label in normal_shifts:
+            for j in range(len(sites)):
+                need = demand(j, d, sh_label) - covered[j, sh_label]
+                if need > 0:
+                    need -= take(j, sh_label, need)
+                if need > 0:
+                    shortage[j, sh_label] = need
+
+        for (j, sh_label), need in shortage.items():
+            for a, b, _ in sorted(lending_pairs, key=lambda pair: pair[2]):
+                if need == 0:
+                    break
+                if b != j or (a, b, d, sh_label) not in lend:
+                    continue
+                lent = take(a, sh_label, need)
+                if lent:
+                    hint_lend[a, b, d, sh_label] = lent
+                    need -= lent
+            if need > 0 and (j, d, sh_label) in support:
+                used = sum(v for (_, dd, _), v in hint_support.items() if dd == d)
+                extra = min(need, support_capacity - used)
+                if extra > 0:
+                    hint_support[j, d, sh_label] = extra
+
+        for s in range(num_staff):
+            label = hint_shift[s][d]
+            states[s] = staff_automata[s].get((states[s], shift_to_index[label]), 0)
+            recent_work[s].append(label != "休み")
+            if label != "休み":
+                hours[s] += label_hours[label]
+
+    return hint_shift, hint_lend, hint_support
+
+
+def complete_hint(model, max_time_in_seconds):
+    # 決定変数だけのヒントを補助変数まで含めた完全なヒントにしておくと、CP-SAT が初手でそのまま採用できる。
+    # ヒントの値に変数を固定して短く解き、解けなければ元のヒントのまま残す。
+    # (かかった秒数, 補完した解の応答 CpSolverResponse または None) を返す
+    hint_solver = cp_model.CpSolver()
+    hint_solver.parameters.fix_variables_to_their_hinted_value = True
+    hint_solver.parameters.max_time_in_seconds = max_time_in_seconds
+    response = None
+    if hint_solver.Solve(model) in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+        response = hint_solver.ResponseProto()
+        model.ClearHints()
+        model.Proto().solution_hint.vars.extend(range(len(response.solution)))
+        model.Proto().solution_hint.values.extend(response.solution)
+    return hint_solver.WallTime(), response
@@ -0,0 +1,78 @@
+from ortools.sat.python import cp_model
+import time
+
+# 段階的最適化で使う目的の既定の優先順位
+DEFAULT_STAGE_ORDER = ["support", "lending", "shift_compat", "workload_diff", "shift_balance", "day_shift"]
+
+
+def build_stages(objective_components, stage_order=None):
+    # 目的の成分 {名前: (重み, 式)} を優先順位の高い順に並べる（重みは符号と 0 による無効化だけに使う）
+    stages = []
+    for name in stage_order or DEFAULT_STAGE_ORDER:
+        if name not in objective_components:
+            continue
+        weight, expr = objective_components[name]
+        if weight == 0 or isinstance(expr, int):
+            continue
+        stages.append((name, expr if weight > 0 else -expr))
+    return stages
+
+
+def solve_staged(model, stages, max_time_in_seconds, solution_callback=None, num_workers=None):
+    # stages: [(名前, 最小化する式), ...] を優先順に解く。
+    # 各段の最良値を上限として固定し、前段の解を次段のヒント（warm start）に使う。
+    # 持ち時間は残り時間を残りの段数で等分し、早く終わった段の余りは後の段に回す。
+    # 後の段が時間切れになっても、最後に解けた段の solver を返す。
+    # 返す status は全段の総合（どこかの段が OPTIMAL でなければ FEASIBLE）。
+    report = []
+    solver = None
+    status = cp_model.UNKNOWN
+    feasible_solver = None
+    all_optimal = True
+    deadline = time.perf_counter() + max_time_in_seconds
+    if not stages:
+        stages = [("feasibility", 0)]
+
+    for i, (name, expr) in enumerate(stages):
+        is_final = i == len(stages) - 1
+        model.Minimize(expr)
+
+        solver = cp_model.CpSolver()
+        remaining = max(deadline - time.perf_counter(), 0.1)
+        solver.parameters.max_time_in_seconds = remaining / (len(stages) - i)
+        if num_workers is not None:
+            solver.parameters.num_workers = num_workers
+        status = solver.Solve(model, solution_callback if is_final else None)
+
+        entry = {
+            "stage": name,
+            "status": solver.StatusName(status),
+            "time": solver.WallTime(),
+            "value": None,
+            "best_bound": None,
+            "timed_out": status == cp_model.UNKNOWN,
+        }
+        report.append(entry)
+        if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            break
+
+        value = int(round(solver.ObjectiveValue()))
+        entry["value"] = value
+        entry["best_bound"] = solver.BestObjectiveBound()
+        feasible_solver = solver
+        all_optimal = all_optimal and status == cp_model.OPTIMAL
+        if is_final:
+            break
+
+        # この段の最良値を次段以降の上限にし、解をそのままヒントとして引き継ぐ
+        model.Add(expr <= value)
+        previous = solver.ResponseProto().solution
+        model.ClearHints()
+        model.Proto().solution_hint.vars.extend(range(len(previous)))
+        model.Proto().solution_hint.values.extend(previous)
+
+    if feasible_solver is None:
+        return solver, status, report
+    # 最後の段まで解けて、どの段も OPTIMAL のときだけ全体を OPTIMAL とする
+    overall = cp_model.OPTIMAL if all_optimal and feasible_solver is solver else cp_model.FEASIBLE
+    return feasible_solver, overall, report
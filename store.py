@@ -0,0 +1,185 @@
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+# 保存先（環境変数で変更可）
+DEFAULT_DB_PATH = os.environ.get("SHIFT_STORE_PATH", "shift_store.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    input_hash TEXT NOT NULL UNIQUE,
+    site TEXT NOT NULL DEFAULT '',
+    year INTEGER,
+    month INTEGER,
+    created_at TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_instances_site_month ON instances (site, year, month);
+
+CREATE TABLE IF NOT EXISTS solutions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    instance_id INTEGER NOT NULL REFERENCES instances (id),
+    solution_index INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    staff_names TEXT NOT NULL,
+    dates TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    roster BLOB NOT NULL,
+    status TEXT,
+    objective REAL,
+    solve_time REAL,
+    stats TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_solutions_instance ON solutions (instance_id, solution_index);
+"""
+
+
+@contextlib.contextmanager
+def _connect(db_path=None):
+    conn = sqlite3.connect(db_path or DEFAULT_DB_PATH)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.executescript(_SCHEMA)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _to_jsonable(value):
+    # 日付キーを含む入力を JSON にできる形へ（キーは文字列化して並びを固定）
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {str(_to_jsonable(k)): _to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = [_to_jsonable(v) for v in value]
+        return sorted(items, key=str) if isinstance(value, set) else items
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def instance_hash(instance, site=""):
+    # 拠点も鍵に含める（同じ入力の別拠点や、拠点名を変えた場合を別のインスタンスとして扱う）
+    payload = json.dumps(
+        {"site": site or "", "instance": _to_jsonable(instance)}, ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def encode_roster(roster, staff_names, dates):
+    # {スタッフ: {日付: ラベル}} を (スタッフ × 日) のラベル番号配列とラベル一覧に変換する
+    labels = sorted({label for name in staff_names for label in roster.get(name, {}).values()})
+    label_to_code = {label: i + 1 for i, label in enumerate(labels)}
+    codes = np.zeros((len(staff_names), len(dates)), dtype=np.uint8)
+    for s, name in enumerate(staff_names):
+        row = roster.get(name, {})
+        for d, date in enumerate(dates):
+            if date in row:
+                codes[s, d] = label_to_code[row[date]]
+    # 0 は未割当
+    return codes, [None] + labels
+
+
+def decode_roster(codes, labels, staff_names, dates):
+    roster = {}
+    for s, name in enumerate(staff_names):
+        roster[name] = {
+            date: labels[code] for date, code in zip(dates, codes[s].tolist()) if code
+        }
+    return roster
+
+
+def save_instance(instance, site="", year=None, month=None, db_path=None):
+    key = instance_hash(instance, site)
+    payload = json.dumps(_to_jsonable(instance), ensure_ascii=False, sort_keys=True)
+    with _connect(db_path) as conn:
+        row = conn.execute("SELECT id FROM instances WHERE input_hash = ?", (key,)).fetchone()
+        if row is not None:
+            return row["id"]
+        cursor = conn.execute(
+            "INSERT INTO instances (input_hash, site, year, month, created_at, payload) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, site or "", year, month, datetime.datetime.now().isoformat(timespec="seconds"), payload),
+        )
+        return cursor.lastrowid
+
+
+def save_solution(instance_id, roster, staff_names, dates, solution_index=0, stats=None, db_path=None):
+    # 表示用の行（応援など）も含めて roster に出てくるスタッフはすべて保存する
+    staff_names = list(staff_names) + [name for name in roster if name not in staff_names]
+    codes, labels = encode_roster(roster, staff_names, dates)
+    stats = stats or {}
+    with _connect(db_path) as conn:
+        cursor = conn.execute(
+            "INSERT INTO solutions (instance_id, solution_index, created_at, staff_names, dates, labels, roster,"
+            " status, objective, solve_time, stats) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                instance_id,
+                solution_index,
+                datetime.datetime.now().isoformat(timespec="seconds"),
+                json.dumps(staff_names, ensure_ascii=False),
+                json.dumps([d.isoformat() for d in dates]),
+                json.dumps(labels, ensure_ascii=False),
+                codes.tobytes(),
+                stats.get("status"),
+                stats.get("objective"),
+                stats.get("solve_time"),
+                json.dumps(_to_jsonable(stats), ensure_ascii=False),
+            ),
+        )
+        return cursor.lastrowid
+
+
+def load_solution(solution_id, db_path=None):
+    # 保存済みの解を {"roster", "staff_names", "dates", "codes", "labels", "stats"} で返す
+    with _connect(db_path) as conn:
+        row = conn.execute("SELECT * FROM solutions WHERE id = ?", (solution_id,)).fetchone()
+    if row is None:
+        return None
+    staff_names = json.loads(row["staff_names"])
+    dates = [datetime.date.fromisoformat(d) for d in json.loads(row["dates"])]
+    labels = json.loads(row["labels"])
+    codes = np.frombuffer(row["roster"], dtype=np.uint8).reshape(len(staff_names), len(dates))
+    return {
+        "id": row["id"],
+        "instance_id": row["instance_id"],
+        "solution_index": row["solution_index"],
+        "staff_names": staff_names,
+        "dates": dates,
+        "codes": codes,
+        "labels": labels,
+        "roster": decode_roster(codes, labels, staff_names, dates),
+        "stats": json.loads(row["stats"]) if row["stats"] else {},
+    }
+
+
+def find_solutions(site=None, year=None, month=None, input_hash=None, solution_index=None, limit=100, db_path=None):
+    # 解の一覧（roster 本体は読まない）。新しい順
+    conditions = []
+    params = []
+    filters = [
+        ("i.site", site), ("i.year", year), ("i.month", month),
+        ("i.input_hash", input_hash), ("s.solution_index", solution_index),
+    ]
+    for column, value in filters:
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = (
+        "SELECT s.id, s.instance_id, s.solution_index, s.created_at, s.status, s.objective, s.solve_time,"
+        " i.site, i.year, i.month, i.input_hash"
+        " FROM solutions s JOIN instances i ON i.id = s.instance_id"
+        f" {where} ORDER BY s.id DESC LIMIT ?"
+    )
+    params.append(limit)
+    with _connect(db_path) as conn:
+        return [dict(row) for row in conn.execute(query, params).fetchall()]
+
@@ -0,0 +1,145 @@
+from datetime import date, timedelta
+
+import pytest
+
+import evaluate
+import multi_site
+import optimizer
+from constants import SUPPORT_STAFF_NAME
+
+DATES = [date(2025, 4, 1) + timedelta(days=i) for i in range(14)]
+SHIFTS = [{"label": "日勤", "hours": 8}, {"label": "夜勤", "hours": 16}]
+STAFF = [f"スタッフ{i + 1}" for i in range(6)]
+
+
+def small_instance(penalties=None):
+    return {
+        "staff_names": STAFF,
+        "shifts": SHIFTS,
+        "dates": DATES,
+        "required_staff": {d: {"日勤": 2, "夜勤": 1} for d in DATES},
+        "leave_requests": {
+            STAFF[0]: {"希望休": [DATES[2]], "有給": [DATES[5]], "シフト希望": {DATES[7]: "日勤"}},
+            STAFF[3]: {"希望休": [DATES[0], DATES[1]], "有給": [], "シフト希望": {}},
+        },
+        "daily_work_hours": {name: 8 for name in STAFF},
+        "use_support_shift": True,
+        "total_work_hours": {name: 80 for name in STAFF[:5]},
+        # スタッフ1は夜勤不可、スタッフ2は一覧に休みがない（休みも対応不可として数える）、スタッフ6は一覧なし
+        "shift_compatibility": {
+            STAFF[0]: ["日勤", "休み"],
+            STAFF[1]: ["日勤", "夜勤"],
+            STAFF[2]: ["日勤", "夜勤", "休み"],
+            STAFF[3]: ["日勤", "夜勤", "休み"],
+            STAFF[4]: ["日勤", "夜勤", "休み"],
+        },
+        "penalties": penalties,
+        "work_rules": {"max_consecutive_work": 5, "min_rest_after": {"夜勤": 1}},
+    }
+
+
+@pytest.mark.parametrize("penalties", [None, {"day_shift_bonus": 3, "shift_compat_penalty": 7}])
+def test_breakdown_matches_solver_objective_for_every_pooled_plan(penalties):
+    instance = small_instance(penalties)
+    pool = []
+    stats = {}
+    result = optimizer.optimize_shifts(
+        **instance, max_time_in_seconds=5.0, solution_pool=pool, solve_stats=stats
+    )
+    assert result is not None
+    assert len(pool) == len(stats["pool_objectives"])
+    for roster, objective in zip(pool, stats["pool_objectives"]):
+        evaluation = evaluate.evaluate_roster(instance, roster)
+        assert evaluation["feasible"], evaluation["violations"]
+        assert evaluation["objective"]["total"] == objective
+
+
+def test_breakdown_matches_single_site_multi_site_objective():
+    instance = small_instance()
+    site = "病棟1"
+    result = multi_site.optimize_multi_site(
+        sites=[site],
+        staff_names=STAFF,
+        staff_home_sites={name: site for name in STAFF},
+        shifts=SHIFTS,
+        dates=DATES,
+        required_staff={site: instance["required_staff"]},
+        leave_requests=instance["leave_requests"],
+        daily_work_hours=instance["daily_work_hours"],
+        total_work_hours=instance["total_work_hours"],
+        shift_compatibility=instance["shift_compatibility"],
+        support_capacity=3,
+        work_rules=instance["work_rules"],
+        max_time_in_seconds=5.0,
+    )
+    assert result["roster"] is not None
+
+    # 拠点ごとの応援人数を optimize_shifts と同じ臨時スタッフ行にまとめる
+    roster = dict(result["roster"])
+    roster[SUPPORT_STAFF_NAME] = {}
+    for d in DATES:
+        used = result["support"][site].get(d, {})
+        detail = "・".join(label if n == 1 else f"{label}×{n}" for label, n in used.items())
+        roster[SUPPORT_STAFF_NAME][d] = f"応援({detail})" if used else "休み"
+
+    evaluation = evaluate.evaluate_roster(instance, roster)
+    assert evaluation["objective"]["total"] == result["stats"]["objective"]
+
+
+def test_each_hard_rule_violation_is_reported():
+    names = [f"S{i}" for i in range(10)]
+    required = {d: {"日勤": 0, "夜勤": 0} for d in DATES}
+    required[DATES[12]] = {"日勤": 3, "夜勤": 0}
+    required[DATES[13]] = {"日勤": 0, "夜勤": 1}
+    instance = {
+        "staff_names": names,
+        "shifts": SHIFTS,
+        "dates": DATES,
+        "required_staff": required,
+        "strict_staffing_days": {DATES[13]: True},
+        "leave_requests": {
+            "S2": {"希望休": [DATES[1]]},
+            "S3": {"有給": [DATES[2]]},
+            "S4": {"シフト希望": {DATES[4]: "夜勤"}},
+        },
+        "daily_work_hours": {name: 8 for name in names},
+        "use_support_shift": False,
+        "work_rules": {
+            "max_consecutive_work": 3,
+            "min_consecutive_work": 2,
+            "max_work_days_per_week": 5,
+            "min_rest_after": {"夜勤": 1},
+            "forbidden_sequences": [["夜勤", "日勤"]],
+        },
+    }
+
+    rows = {name: ["休み"] * len(DATES) for name in names}
+    rows["S0"][0] = None                                     # 未割当
+    rows["S1"][0] = "早番"                                    # 不明なシフト
+    rows["S2"][1] = "日勤"                                    # 希望休
+    rows["S3"][2] = "日勤"                                    # 有給（申請日に勤務）
+    rows["S3"][3] = "有給"                                    # 有給（申請なし）
+    rows["S4"][4] = "日勤"                                    # シフト希望
+    rows["S5"][0:4] = ["日勤"] * 4                            # 連続勤務上限
+    rows["S6"][6] = "日勤"                                    # 連続勤務下限
+    rows["S7"][0:7] = ["日勤"] * 3 + ["休み"] + ["日勤"] * 3   # 週の勤務日数上限
+    rows["S8"][8:10] = ["夜勤", "日勤"]                        # 明けの休み・禁止並び
+    rows["S8"][11] = "日勤"                                   # 必要人数0
+    rows["S9"][12] = "日勤"                                   # 必要人数不足
+    rows["S8"][13] = "夜勤"                                   # 必要人数超過（固定の日に2人）
+    rows["S9"][13] = "夜勤"
+    roster = {
+        name: {d: label for d, label in zip(DATES, labels) if label is not None}
+        for name, labels in rows.items()
+    }
+    roster[SUPPORT_STAFF_NAME] = {d: "休み" for d in DATES}
+    roster[SUPPORT_STAFF_NAME][DATES[10]] = "応援(日勤)"       # 応援上限（応援なしの設定）
+
+    evaluation = evaluate.evaluate_roster(instance, roster)
+    assert not evaluation["feasible"]
+    kinds = set(evaluation["violations"]["種類"])
+    assert kinds >= {
+        "未割当", "不明なシフト", "希望休", "有給", "シフト希望",
+        "連続勤務上限", "連続勤務下限", "週の勤務日数上限", "明けの休み", "禁止並び",
+        "応援上限", "必要人数0", "必要人数不足", "必要人数超過",
+    }
@@ -0,0 +1,85 @@
+import itertools
+
+import pytest
+from ortools.sat.python import cp_model
+
+import rules
+
+SHIFT_LABELS = ["日勤", "夜勤", "休み"]
+NUM_DAYS = 7
+
+RULE_SETS = [
+    {"max_consecutive_work": 4},
+    {"max_consecutive_work": 3, "min_rest_after": {"夜勤": 2}},
+    {"max_consecutive_work": 5, "forbidden_sequences": [["夜勤", "日勤"], ["日勤", "夜勤", "日勤"]]},
+    {"min_consecutive_work": 3, "max_consecutive_work": 4},
+    {"min_consecutive_work": 2, "max_consecutive_work": 4, "min_rest_after": {"夜勤": 1}},
+]
+
+
+def model_accepts(rule, seq):
+    model = cp_model.CpModel()
+    x = {
+        (0, d, sh): model.NewConstant(int(seq[d] == sh))
+        for d in range(NUM_DAYS)
+        for sh in range(len(SHIFT_LABELS))
+    }
+    rules.add_work_rules(model, x, ["A"], NUM_DAYS, SHIFT_LABELS, rule)
+    return cp_model.CpSolver().Solve(model) == cp_model.OPTIMAL
+
+
+def automaton_accepts(automaton, seq):
+    state = 0
+    for sh in seq:
+        if (state, sh) not in automaton.transitions:
+            return False
+        state = automaton.transitions[state, sh]
+    return True
+
+
+def short_run_at_end(rule, seq):
+    # 期間の最後の (下限−1) 日に始まり、下限に届かずに休みで終わる連続勤務があるか
+    min_work = rule.get("min_consecutive_work") or 0
+    rest_idx = SHIFT_LABELS.index("休み")
+    for d in range(max(NUM_DAYS - min_work + 1, 1), NUM_DAYS):
+        if seq[d] != rest_idx and seq[d - 1] == rest_idx:
+            run = 0
+            while d + run < NUM_DAYS and seq[d + run] != rest_idx:
+                run += 1
+            if d + run < NUM_DAYS and run < min_work:
+                return True
+    return False
+
+
+@pytest.mark.parametrize("rule", RULE_SETS)
+def test_automaton_is_model_minus_end_of_period_exemption(rule):
+    # オートマトンはモデルより厳しく、違うのは期間末の短い連続勤務だけ
+    resolved = rules.resolve_work_rules(rule, "A")
+    automaton = rules.compile_work_automaton(resolved, SHIFT_LABELS)
+    for seq in itertools.product(range(len(SHIFT_LABELS)), repeat=NUM_DAYS):
+        by_model = model_accepts(rule, seq)
+        by_automaton = automaton_accepts(automaton, seq)
+        if by_automaton:
+            assert by_model, seq
+        elif by_model:
+            assert short_run_at_end(resolved, seq), seq
+
+
+def test_min_consecutive_end_of_period_example():
+    rule = {"min_consecutive_work": 3, "max_consecutive_work": 4}
+    seq = [SHIFT_LABELS.index(label) for label in ["日勤"] * 4 + ["休み", "日勤", "休み"]]
+    automaton = rules.compile_work_automaton(rules.resolve_work_rules(rule, "A"), SHIFT_LABELS)
+    assert model_accepts(rule, seq)
+    assert not automaton_accepts(automaton, seq)
+
+
+def test_work_rule_errors_flags_contradictory_bounds():
+    assert rules.work_rule_errors({"max_consecutive_work": 6, "min_consecutive_work": 2}) == []
+    errors = rules.work_rule_errors({
+        "max_consecutive_work": 6,
+        "min_consecutive_work": 2,
+        "max_work_days_per_week": 4,
+        "staff": {"A": {"min_consecutive_work": 7}},
+    })
+    assert len(errors) == 2
+    assert all(message.startswith("A:") for message in errors)